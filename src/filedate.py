@@ -21,12 +21,19 @@ SOFTWARE.
 '''
 import pathlib
 import os
-import glob
 import time
 import datetime
 import re
+import stat
+import struct
 import exif
 import argparse
+import sys
+import collections
+import concurrent.futures
+import threading
+import sqlite3
+import fnmatch
 
 
 class NewNameStrategy():
@@ -37,6 +44,79 @@ class NewNameStrategy():
     SKIP_DIR = 4
 
 
+# suffixes of files EXIF data is read from
+EXIF_SUFFIXES = ['.jpg', '.jpeg', '.jpe', '.jif', '.jfif', '.jfi']
+
+# metadata cache: entries not used for this many days are evicted,
+# new and used entries are written in batches of this size
+CACHE_MAX_AGE_DAYS = 180
+CACHE_BATCH_ENTRIES = 10000
+
+
+class MetadataCache():
+    # persistent cache of the results of get_new_filename for files with EXIF data,
+    # keyed by absolute path, size and mtime. thread-safe
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.path = path
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS entries(
+            path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL,
+            new_name TEXT NOT NULL, strategy INTEGER NOT NULL, last_used INTEGER NOT NULL)""")
+        self.now = int(time.time())
+        self.new_entries = []
+        self.used_paths = []
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    def get(self, path, st):
+        # returns [new filename, strategy], or None
+        with self.lock:
+            row = self.db.execute("SELECT new_name, strategy FROM entries WHERE path = ? AND size = ? AND mtime_ns = ?",
+                                  (path, st.st_size, st.st_mtime_ns)).fetchone()
+            if row:
+                self.hits += 1
+                self.used_paths.append((self.now, path))
+                if len(self.used_paths) >= CACHE_BATCH_ENTRIES:
+                    self.flush()
+                return list(row)
+            self.misses += 1
+            return None
+
+    def put(self, path, st, new_name, strategy):
+        with self.lock:
+            self.new_entries.append((path, st.st_size, st.st_mtime_ns, new_name, strategy, self.now))
+            if len(self.new_entries) >= CACHE_BATCH_ENTRIES:
+                self.flush()
+
+    def flush(self):
+        # called with lock held
+        with self.db:
+            self.db.executemany("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)", self.new_entries)
+            self.db.executemany("UPDATE entries SET last_used = ? WHERE path = ?", self.used_paths)
+        self.new_entries = []
+        self.used_paths = []
+
+    def close(self):
+        with self.lock:
+            self.flush()
+            with self.db:
+                self.evicted = self.db.execute("DELETE FROM entries WHERE last_used < ?",
+                                               (self.now - CACHE_MAX_AGE_DAYS * 24 * 3600,)).rowcount
+            self.db.close()
+
+    def get_files(self):
+        # normalized absolute paths of the database and its journal files, to be left out of scans
+        path = os.path.normcase(os.path.abspath(self.path))
+        return {path + post for post in ("", "-journal", "-wal", "-shm")}
+
+    def get_report(self):
+        num = self.hits + self.misses
+        hit_rate = f'{100 * self.hits / num:.1f}%' if num else '-'
+        return f'cache hits: {self.hits}, misses: {self.misses} ({hit_rate} hit rate), evicted: {self.evicted}'
+
+
 # matches filenames already starting with YYYY-MM-DD-hhmmss
 re_filedate = re.compile(r'^\d{4}-\d{2}-\d{2}-\d{6}')
 
@@ -72,11 +152,162 @@ re_date5 = re.compile(r'(\D|^)(\d{10}|\d{13})(\D|$)')
 # the order is asumed to be like in the examples
 re_date6 = re.compile(r'(\D|^)(\d{14}|\d{17})(\D|$)')
 
+# JPEG header size read for EXIF data. the APP1 segment is 64 KiB at most,
+# and is read completely, if it extends beyond
+EXIF_HEADER_SIZE = 64 * 1024
+# EXIF tags: pointer to EXIF IFD (in IFD0), DateTimeOriginal (in EXIF IFD), ASCII type
+EXIF_TAG_EXIF_IFD = 0x8769
+EXIF_TAG_DATETIME_ORIGINAL = 0x9003
+EXIF_TYPE_ASCII = 2
+
+# plan file written by --dry, named to be skipped by later runs itself.
+# one rename per line: <source path>\t<new filename>
+PLAN_FILENAME_POST = "filedate_plan.txt"
+
+# wildcards of glob-style file patterns
+re_glob_magic = re.compile(r'[*?[]')
+
 # matches files that are skipped
 re_skiplist = re.compile(r'^(Thumbs\.db)$')
 
+# all filename date patterns need a run of 4 digits at least,
+# names without are classified with this single search
+re_digits = re.compile(r'\d{4}')
+
+
+def get_time_str_date5(m):
+    # convert assumed timestamp to UTC time (we don't know it better)
+    dt = datetime.datetime.fromtimestamp(int(m[2][:10]), datetime.timezone.utc)
+    return dt.strftime("%Y-%m-%d-%H%M%S")
+
+
+# filename date patterns in order of precedence,
+# with functions returning YYYY-MM-DD-hhmmss from the match, and log message
+NAME_DATE_MATCHERS = [
+    (re_date1, lambda m: f'{m[2][0:4]}-{m[2][4:6]}-{m[2][6:8]}-000000',
+     'USING DATE FROM FILENAME (MESSENGER)'),
+    (re_date2, lambda m: f'{m[2]}-{m[4]}{m[6]}{m[8]}',
+     'USING DATE FROM FILENAME (2)'),
+    (re_date3, lambda m: f'{m[2][0:4]}-{m[2][4:6]}-{m[2][6:8]}-{m[4][0:6]}',
+     'USING DATE FROM FILENAME (3)'),
+    # 2-digit year is prefixed with 20 (07 -> 2007)
+    (re_date4, lambda m: f'20{m[3]}-{m[2]}-{m[1]}-{m[4]}00',
+     'USING DATE FROM FILENAME (4)'),
+    (re_date5, get_time_str_date5,
+     'USING DATE FROM FILENAME (5)'),
+    (re_date6, lambda m: f'{m[2][0:4]}-{m[2][4:6]}-{m[2][6:8]}-{m[2][8:14]}',
+     'USING DATE FROM FILENAME (6)'),
+]
+
+
+def get_name_date(name):
+    # returns [YYYY-MM-DD-hhmmss, log message] from the first matching
+    # filename date pattern, or [None, None]
+    if not re_digits.search(name):
+        return [None, None]
+    for pattern, get_time_str, msg in NAME_DATE_MATCHERS:
+        re_matches = pattern.search(name)
+        if re_matches:
+            return [get_time_str(re_matches), msg]
+    return [None, None]
+
+
+def find_ifd_entry(tiff, byte_order, ifd_offset, tag):
+    # returns [type, count, raw 4 byte value/offset] of tag in the IFD at ifd_offset, or None
+    num_entries = struct.unpack_from(f'{byte_order}H', tiff, ifd_offset)[0]
+    for i in range(num_entries):
+        entry_tag, entry_type, count, value = struct.unpack_from(
+            f'{byte_order}HHI4s', tiff, ifd_offset + 2 + 12 * i)
+        if entry_tag == tag:
+            return [entry_type, count, value]
+    return None
+
+
+def parse_tiff_datetime_original(tiff):
+    # DateTimeOriginal from the TIFF structure of an EXIF APP1 segment, or None
+    if tiff[:2] == b'II':
+        byte_order = '<'
+    elif tiff[:2] == b'MM':
+        byte_order = '>'
+    else:
+        raise ValueError('invalid TIFF header')
+    ifd0_offset = struct.unpack_from(f'{byte_order}I', tiff, 4)[0]
+
+    entry = find_ifd_entry(tiff, byte_order, ifd0_offset, EXIF_TAG_EXIF_IFD)
+    if not entry:
+        return None
+    exif_ifd_offset = struct.unpack(f'{byte_order}I', entry[2])[0]
+
+    entry = find_ifd_entry(tiff, byte_order, exif_ifd_offset, EXIF_TAG_DATETIME_ORIGINAL)
+    if not entry:
+        return None
+    entry_type, count, value = entry
+    if entry_type != EXIF_TYPE_ASCII:
+        raise ValueError('unexpected DateTimeOriginal type')
+    if count > 4:
+        value_offset = struct.unpack(f'{byte_order}I', value)[0]
+        value = tiff[value_offset:value_offset + count]
+        if len(value) < count:
+            raise ValueError('truncated DateTimeOriginal')
+    return value[:count].split(b'\0')[0].decode('ascii').strip()
+
+
+def read_exif_datetime_original(fp):
+    # reads DateTimeOriginal from the APP1 segment in the JPEG header only,
+    # without loading the whole file. returns None if there is none.
+    # raises ValueError for files this parser can not handle
+    with open(fp, 'rb') as f:
+        data = f.read(EXIF_HEADER_SIZE)
+        if data[:2] != b'\xff\xd8':
+            raise ValueError('no JPEG SOI marker')
+        pos = 2
+        try:
+            while True:
+                if data[pos] != 0xFF:
+                    raise ValueError('invalid JPEG marker')
+                marker = data[pos + 1]
+                if marker == 0xFF:
+                    # fill byte
+                    pos += 1
+                elif marker in (0xDA, 0xD9):
+                    # start of scan or end of image, no EXIF APP1 segment before
+                    return None
+                elif 0xD0 <= marker <= 0xD8 or marker == 0x01:
+                    # markers without length
+                    pos += 2
+                else:
+                    length = struct.unpack_from('>H', data, pos + 2)[0]
+                    segment_end = pos + 2 + length
+                    if marker == 0xE1 and data[pos + 4:pos + 10] == b'Exif\0\0':
+                        if segment_end > len(data):
+                            data += f.read(segment_end - len(data))
+                        return parse_tiff_datetime_original(data[pos + 10:segment_end])
+                    pos = segment_end
+        except (IndexError, struct.error, UnicodeDecodeError) as e:
+            raise ValueError(f'invalid JPEG header: {e}')
+
+
+def get_exif_date(fp):
+    # returns YYYY-MM-DD-hhmmss from EXIF DateTimeOriginal, or None.
+    # raises on files that can not be read or parsed
+    try:
+        datetime_original = read_exif_datetime_original(fp)
+    except ValueError:
+        # fall back to exif, which loads the whole file
+        datetime_original = None
+        with open(fp, 'rb') as img_file:
+            img = exif.Image(img_file)
+            if img.has_exif and hasattr(img, "datetime_original"):
+                datetime_original = img.datetime_original
+    if not datetime_original:
+        return None
+    # convert format from exif (YYYY:MM:DD hh:mm:ss) to YYYY-MM-DD-hhmmss
+    exif_time_struct = time.strptime(datetime_original, '%Y:%m:%d %H:%M:%S')
+    return time.strftime('%Y-%m-%d-%H%M%S', exif_time_struct)
+
 
 def rename_file_inplace(src, new_name, dry_run=False, verbose=True):
+    # returns False if the rename failed
     if verbose:
         print(f'    -> {src}')
         print(f'    -> {os.path.join(src.parent, new_name)}')
@@ -85,129 +316,256 @@ def rename_file_inplace(src, new_name, dry_run=False, verbose=True):
             os.rename(src, os.path.join(src.parent, new_name))
         except:
             print('RENAME FAILED')
+            return False
+    return True
+
 
+def get_new_filename(fp, noexif=False, log=None, st=None, cache=None):
+    # returns [new filename, strategy]. does not print anything,
+    # unless a log function is given, which is called with a message per step.
+    # st is the stat result of fp, if known already. otherwise fp is stat'ed once.
+    # results of files with EXIF data are looked up in and added to cache, if given
+    fp = pathlib.Path(fp)
 
-def get_new_filename(fp, noexif = False):
-    file_name_new = None
-    strategy = NewNameStrategy.UNSPECIFIED
+    if st is None:
+        try:
+            st = os.stat(fp)
+        except OSError:
+            pass
 
     # skip directories
-    if os.path.isdir(fp):
-        print('    -> SKIP DIRECTORY')
+    if st is not None and stat.S_ISDIR(st.st_mode):
+        if log:
+            log('SKIP DIRECTORY')
         return [None, NewNameStrategy.SKIP_DIR]
 
     # skip filenames in skiplist
     # skip files that already start with YYYY-MM-DD-hhmmss
-    if re.search(re_skiplist, fp.name) != None or \
-            re.search(re_filedate, fp.stem) != None:
-        print('    -> SKIP')
+    if re_skiplist.search(fp.name) or re_filedate.search(fp.stem):
+        if log:
+            log('SKIP')
         return [None, NewNameStrategy.SKIP]
 
+    use_exif = (not noexif) and fp.suffix.lower() in EXIF_SUFFIXES
+    if not (use_exif and cache is not None and st is not None):
+        return get_date_filename(fp, use_exif, log, st)
+
+    # reading EXIF data is the expensive part, so these results are cached
+    path = os.path.abspath(fp)
+    result = cache.get(path, st)
+    if result:
+        if log:
+            log('USING CACHED DATE')
+        return result
+    result = get_date_filename(fp, use_exif, log, st)
+    cache.put(path, st, *result)
+    return result
+
+
+def get_date_filename(fp, use_exif, log=None, st=None):
     # date from EXIF data
-    if (not file_name_new) and (not noexif) and \
-            fp.suffix.lower() in ['.jpg', '.jpeg', '.jpe', '.jif', '.jfif', '.jfi']:
-        with open(fp, 'rb') as img_file:
-            try:
-                img = exif.Image(img_file)
-                if img.has_exif and hasattr(img, "datetime_original"):
-                    strategy = NewNameStrategy.EXIF
-                    # convert format from exif (YYYY:MM:DD hh:mm:ss) to YYYY-MM-DD-hhmmss
-                    exif_time_struct = time.strptime(
-                        img.datetime_original, '%Y:%m:%d %H:%M:%S')
-                    exif_time_str = time.strftime(
-                        '%Y-%m-%d-%H%M%S', exif_time_struct)
-
-                    file_name_new = f'{exif_time_str}_{fp.name}'
-                    print('    -> USING DATE FROM EXIF DATA')
-            except:
-                print('    -> FAILED TO LOAD EXIF DATA')
-
-    # date from messenger filename
-    if not file_name_new:
-        re_matches = re.search(re_date1, fp.name)
-        if re_matches != None:
-            time_str = f'{re_matches[2][0:4]}-{re_matches[2][4:6]}-{re_matches[2][6:8]}-000000'
-            file_name_new = f'{time_str}_{fp.name}'
-            print('    -> USING DATE FROM FILENAME (MESSENGER)')
-
-    # date from filename (re_date2)
-    if not file_name_new:
-        re_matches = re.search(re_date2, fp.name)
-        if re_matches != None:
-            time_str = f'{re_matches[2]}-{re_matches[4]}{re_matches[6]}{re_matches[8]}'
-            file_name_new = f'{time_str}_{fp.name}'
-            print('    -> USING DATE FROM FILENAME (2)')
-
-    # date from filename (re_date3)
-    if not file_name_new:
-        re_matches = re.search(re_date3, fp.name)
-        if re_matches != None:
-            time_str = f'{re_matches[2][0:4]}-{re_matches[2][4:6]}-{re_matches[2][6:8]}-{re_matches[4][0:6]}'
-            file_name_new = f'{time_str}_{fp.name}'
-            print('    -> USING DATE FROM FILENAME (3)')
-
-    # date from filename (re_date4)
-    if not file_name_new:
-        re_matches = re.search(re_date4, fp.name)
-        if re_matches != None:
-            # 2-digit year is prefixed with 20 (07 -> 2007)
-            time_str = f'20{re_matches[3]}-{re_matches[2]}-{re_matches[1]}-{re_matches[4]}00'
-            file_name_new = f'{time_str}_{fp.name}'
-            print('    -> USING DATE FROM FILENAME (4)')
-
-    # date from filename (re_date5)
-    if not file_name_new:
-        re_matches = re.search(re_date5, fp.name)
-        if re_matches != None:
-            # convert assumed timestamp to UTC time (we don't know it better)
-            dt = datetime.datetime.utcfromtimestamp(
-                int(re_matches[2][:10]))
-            time_str = dt.strftime("%Y-%m-%d-%H%M%S")
-            file_name_new = f'{time_str}_{fp.name}'
-            print('    -> USING DATE FROM FILENAME (5)')
-
-    # date from filename (re_date6)
-    if not file_name_new:
-        re_matches = re.search(re_date6, fp.name)
-        if re_matches != None:
-            time_str = f'{re_matches[2][0:4]}-{re_matches[2][4:6]}-{re_matches[2][6:8]}-{re_matches[2][8:14]}'
-            file_name_new = f'{time_str}_{fp.name}'
-            print('    -> USING DATE FROM FILENAME (6)')
+    if use_exif:
+        try:
+            exif_time_str = get_exif_date(fp)
+            if exif_time_str:
+                if log:
+                    log('USING DATE FROM EXIF DATA')
+                return [f'{exif_time_str}_{fp.name}', NewNameStrategy.EXIF]
+        except:
+            if log:
+                log('FAILED TO LOAD EXIF DATA')
+
+    # date from filename
+    time_str, msg = get_name_date(fp.name)
+    if time_str:
+        if log:
+            log(msg)
+        return [f'{time_str}_{fp.name}', NewNameStrategy.UNSPECIFIED]
 
     # date from last modified date (fallback)
-    if not file_name_new:
-        strategy = NewNameStrategy.MODIFIED_DATE
-        mtime = os.path.getmtime(fp)
-        # file modified struct_time
-        mtime_struct = time.gmtime(mtime)
-        # file modified time string
-        mtime_str = time.strftime('%Y-%m-%d-%H%M%S', mtime_struct)
-        file_name_new = f'{mtime_str}_{fp.name}'
-        print('    -> USING FILE MODIFIED DATE')
+    if st is None:
+        if log:
+            log('NO DATE FOUND')
+        return [None, NewNameStrategy.UNSPECIFIED]
+    # file modified time string
+    mtime_str = time.strftime('%Y-%m-%d-%H%M%S', time.gmtime(st.st_mtime))
+    if log:
+        log('USING FILE MODIFIED DATE')
+    return [f'{mtime_str}_{fp.name}', NewNameStrategy.MODIFIED_DATE]
+
+
+def get_new_filenames(items, noexif=False, log=None, cache=None):
+    # batch version of get_new_filename. items are paths (or names),
+    # or (path, stat result) tuples. returns [path, new filename, strategy] per item
+    result = []
+    for item in items:
+        fp, st = item if isinstance(item, tuple) else (item, None)
+        result.append([fp, *get_new_filename(fp, noexif, log, st, cache)])
+    return result
+
+
+def has_magic(s):
+    return re_glob_magic.search(s) is not None
+
+
+def scan_dir(path):
+    # sorted os.scandir entries of path, or None
+    try:
+        with os.scandir(path) as it:
+            return sorted(it, key=lambda e: e.name)
+    except OSError:
+        return None
+
+
+def iter_glob_entries(base, parts, entries=None):
+    # yields (path, stat result) of the entries below base matching the pattern parts,
+    # with one os.scandir per directory. entries are the scan_dir entries of base, if
+    # listed already. like glob, names starting with '.' are only matched by parts
+    # starting with '.', and '**' matches zero or more directories.
+    # unlike glob, '**' does not descend into symlinked directories, to not run into loops
+    part, rest = parts[0], parts[1:]
+
+    if not has_magic(part):
+        path = os.path.join(base, part)
+        if rest:
+            if os.path.isdir(path):
+                yield from iter_glob_entries(path, rest)
+        else:
+            try:
+                yield path, os.stat(path)
+            except OSError:
+                pass
+        return
+
+    if entries is None:
+        entries = scan_dir(base)
+        if entries is None:
+            return
+
+    if part == '**' and rest:
+        # zero directories, matched against the same entries of base
+        yield from iter_glob_entries(base, rest, entries)
 
-    return [file_name_new, strategy]
+    for e in entries:
+        try:
+            if part == '**':
+                if e.name.startswith('.'):
+                    continue
+                if not rest:
+                    yield e.path, e.stat()
+                if e.is_dir(follow_symlinks=False):
+                    yield from iter_glob_entries(e.path, parts)
+            elif fnmatch.fnmatch(e.name, part) and (part.startswith('.') or not e.name.startswith('.')):
+                if rest:
+                    if e.is_dir():
+                        yield from iter_glob_entries(e.path, rest)
+                else:
+                    yield e.path, e.stat()
+        except OSError:
+            continue
+
+
+def iter_glob_files(pattern, root=None):
+    # streaming replacement of glob.glob(os.path.join(root, pattern), recursive=True),
+    # yielding (path, stat result). directories are yielded too, like by glob
+    drive, path = os.path.splitdrive(os.path.abspath(os.path.join(root or os.getcwd(), pattern)))
+    parts = [p for p in path.split(os.sep) if p]
+    if not parts:
+        return
+    # leading parts without wildcards are the base directory
+    num_base = 0
+    while num_base < len(parts) - 1 and not has_magic(parts[num_base]):
+        num_base += 1
+    base = drive + os.sep + os.sep.join(parts[:num_base])
+    yield from iter_glob_entries(base, parts[num_base:])
+
+
+def scan_file(fp, st=None, noexif=False, cache=None):
+    # returns [path, new filename, strategy, log messages]
+    msgs = []
+    return [fp, *get_new_filename(fp, noexif, msgs.append, st, cache), msgs]
+
+
+def iter_scan_files(items, noexif=False, jobs=1, cache=None):
+    # yields scan_file results in order of items, which are (path, stat result) tuples.
+    # files are scanned in parallel, as reading EXIF data from slow storage is latency bound.
+    # the number of pending files is bounded, so items may be a long generator
+    if jobs <= 1:
+        for fp, st in items:
+            yield scan_file(fp, st, noexif, cache)
+        return
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        pending = collections.deque()
+        for fp, st in items:
+            pending.append(executor.submit(scan_file, fp, st, noexif, cache))
+            if len(pending) >= jobs * 4:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def write_plan(path, plan):
+    with open(path, 'w', encoding='utf-8') as f:
+        for fp, file_name_new in plan:
+            f.write(f'{fp}\t{file_name_new}\n')
+
+
+def read_plan(path):
+    plan = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for l in f:
+            fields = l.rstrip('\n').split('\t')
+            if len(fields) != 2 or not fields[0] or not fields[1]:
+                print(f'ERROR: parsing plan file {path} failed: {l.rstrip()}')
+                sys.exit(2)
+            plan.append([pathlib.Path(fields[0]), fields[1]])
+    return plan
+
+
+def apply_plan(path):
+    # renames as planned by a dry run, without scanning the files again
+    plan = read_plan(path)
+    num_failed = 0
+    for fp, file_name_new in plan:
+        print(f'{fp}')
+        if not rename_file_inplace(fp, file_name_new):
+            num_failed += 1
+    print(f'planned: {len(plan)}, renamed: {len(plan) - num_failed}, failed: {num_failed}')
 
 
 def main(args):
+    if args.apply:
+        apply_plan(args.apply)
+        return
+    if not args.file_pattern:
+        print('ERROR: file_pattern is required, unless --apply is given')
+        sys.exit(1)
+
     # counters for report
     num_glob_items = 0
     num_skipped_items = 0
     num_skipped_dirs = 0
     num_exif_used = 0
     num_modified_date_used = 0
-
-    for f in glob.glob(os.path.join(os.getcwd(), args.file_pattern), recursive=True):
-        print(f'{f}')
+    plan = []
+    cache = MetadataCache(args.cache) if args.cache else None
+
+    # files are walked lazily, with their stat results reused for the scan.
+    # the cache is left out, it must not be renamed while open
+    cache_files = cache.get_files() if cache else set()
+    items = ((pathlib.Path(f), st) for f, st in iter_glob_files(args.file_pattern)
+             if os.path.normcase(f) not in cache_files)
+    for fp, file_name_new, strategy, msgs in iter_scan_files(items, args.noexif, args.jobs, cache):
+        print(f'{fp}')
+        for msg in msgs:
+            print(f'    -> {msg}')
         num_glob_items += 1
 
-        fp = pathlib.Path(f)
-
-        # retrieve new filename and used strategy
-        file_name_new, strategy = get_new_filename(fp, args.noexif)
-
         # perform the actual rename
         if file_name_new:
             rename_file_inplace(fp, file_name_new, args.dry)
+            plan.append([fp, file_name_new])
 
         # increment counters for report based on renaming strategy
         if strategy == NewNameStrategy.EXIF:
@@ -229,20 +587,39 @@ skipped (directories): {num_skipped_items+num_skipped_dirs} ({num_skipped_dirs})
     print(
         f'other date used:    {num_glob_items-num_skipped_items-num_exif_used-num_modified_date_used}')
 
+    if cache:
+        cache.close()
+        print(cache.get_report())
+
+    if args.dry:
+        plan_path = args.plan or \
+            f'{datetime.datetime.now().strftime("%Y-%m-%d-%H%M%S")}_{PLAN_FILENAME_POST}'
+        write_plan(plan_path, plan)
+        print(f'plan with {len(plan)} renames written to {plan_path}, execute it with --apply')
+
 
 if __name__ == "__main__":
     aPars = argparse.ArgumentParser(description="Renames files by prepending YYYY-MM-DD-hhmmss_ NO MATTER WHAT,\n\
 using different criteria, such as parsing date/time from the\n\
 original filename, reading exif data or using the file modification date.",
                                     formatter_class=argparse.RawTextHelpFormatter)
-    aPars.add_argument("target_dir", type=str,
+    aPars.add_argument("target_dir", type=str, nargs='?', default='.',
                        help='target directory. use \'.\' for in-place rename. NOT IMPLEMENTED')
-    aPars.add_argument("file_pattern", type=str,
+    aPars.add_argument("file_pattern", type=str, nargs='?',
                        help='file pattern. base is cwd. use \'**/*\' for all files recursive')
     aPars.add_argument('--noexif', action='store_true',
                        help='do not use exif data at all')
     aPars.add_argument('--dry', action='store_true',
-                       help='perform a dry-run only')
+                       help='perform a dry-run only, and write the planned renames to a plan file')
+    aPars.add_argument('--plan', type=str, default=None,
+                       help=f'plan file written by --dry. default: YYYY-MM-DD-hhmmss_{PLAN_FILENAME_POST} in cwd')
+    aPars.add_argument('--apply', type=str, default=None,
+                       help='execute the renames of a plan file written by --dry, without scanning again')
+    aPars.add_argument('-j', '--jobs', type=int, default=1,
+                       help='number of files scanned in parallel. default: 1')
+    aPars.add_argument('--cache', type=str, default=None,
+                       help=f'metadata cache file, keeping dates read from EXIF data across runs.\n\
+entries not used for {CACHE_MAX_AGE_DAYS} days are evicted. default: no cache')
     args = aPars.parse_args()
 
     main(args)
@@ -20,43 +20,382 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 '''
 import pathlib
-import glob
 import os
+import sys
+import time
+import shutil
 import argparse
+import collections
+import threading
+import queue
+import datetime
 import filedate
+import treesum
+
+
+# suffix of files being copied, renamed to their final name when complete
+COPY_TMP_SUFFIX = ".importmedia-part"
+# bytes per copy_file_range/sendfile call, and buffer size of the fallback copy
+COPY_BLOCK_SIZE = 8 * 1024 * 1024
+
+# copy pipeline (hashing while copying): bytes per read, blocks queued between reader and writer
+PIPELINE_BLOCK_SIZE = 1024 * 1024
+PIPELINE_QUEUE_BLOCKS = 32
+# treesum compatible list of imported files, written to cwd by --list
+DST_LIST_FILENAME_PRE = "importmedia"
+
+# subdirectories of the target directory, from the YYYY-MM-DD date prefix of the new name
+SUBDIR_LAYOUTS = {
+    "y": lambda name: name[0:4],
+    "ym": lambda name: name[0:7],
+    "ymd": lambda name: name[0:10],
+}
+
+
+def index_target(target_dir):
+    # name -> [[path, size, hash or None, path to hash], ...] of all files below target_dir.
+    # hashes are only computed on demand, see get_index_hash
+    index = collections.defaultdict(list)
+    stack = [target_dir]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as it:
+                for e in it:
+                    if e.is_dir(follow_symlinks=False):
+                        stack.append(e.path)
+                    elif e.is_file() and not e.name.endswith(COPY_TMP_SUFFIX):
+                        index[e.name].append([e.path, e.stat().st_size, None, e.path])
+        except OSError:
+            continue
+    return index
+
+
+def get_index_hash(entry):
+    if entry[2] is None:
+        entry[2] = treesum.get_file_hash(entry[3])
+    return entry[2]
+
+
+def find_present(index, name, size, src, compare_hash=False):
+    # returns the path of a file in the target directory with the same name and size
+    # (and hash, if compare_hash), or None
+    src_hash = None
+    for entry in index.get(name, []):
+        if entry[1] != size:
+            continue
+        if compare_hash:
+            if src_hash is None:
+                src_hash = treesum.get_file_hash(src)
+            if get_index_hash(entry) != src_hash:
+                continue
+        return entry[0]
+    return None
+
+
+def copy_file_data(f_src, f_dst):
+    # copies in the kernel with os.copy_file_range (Linux) or os.sendfile, where available.
+    # falls back to a buffered copy from the current file positions, if not supported
+    if hasattr(os, "copy_file_range"):
+        try:
+            while os.copy_file_range(f_src.fileno(), f_dst.fileno(), COPY_BLOCK_SIZE):
+                pass
+            return
+        except OSError:
+            pass
+    if sys.platform.startswith("linux") and hasattr(os, "sendfile"):
+        try:
+            while os.sendfile(f_dst.fileno(), f_src.fileno(), None, COPY_BLOCK_SIZE):
+                pass
+            return
+        except OSError:
+            pass
+    shutil.copyfileobj(f_src, f_dst, COPY_BLOCK_SIZE)
+
+
+def copy_file(src, dst):
+    # copies src to dst, including its modification time. the data is written to a
+    # temporary file first, so an interrupted import leaves no incomplete dst behind
+    dst_tmp = dst + COPY_TMP_SUFFIX
+    try:
+        with open(src, "rb", buffering=0) as f_src, open(dst_tmp, "wb", buffering=0) as f_dst:
+            copy_file_data(f_src, f_dst)
+        shutil.copystat(src, dst_tmp)
+        os.replace(dst_tmp, dst)
+    except BaseException:
+        try:
+            os.remove(dst_tmp)
+        except OSError:
+            pass
+        raise
+
+
+def remove_tmp(dst):
+    try:
+        os.remove(dst + COPY_TMP_SUFFIX)
+    except OSError:
+        pass
+
+
+def finish_copy(src, dst):
+    shutil.copystat(src, dst + COPY_TMP_SUFFIX)
+    os.replace(dst + COPY_TMP_SUFFIX, dst)
+
+
+def iter_copy_pipeline(copies, algo, block_size=PIPELINE_BLOCK_SIZE, sync=False):
+    # copies [src, dst, ...] items, hashing the data while copying, in a single read pass.
+    # one thread reads the source files one after another into a bounded queue, while
+    # this thread hashes and writes, so reads from the source overlap writes to the target,
+    # across files too. sync flushes each dst to disk before closing it (for verify_copy).
+    # yields [item, hash, None] or [item, None, error] per item
+    q = queue.Queue(maxsize=PIPELINE_QUEUE_BLOCKS)
+
+    def read():
+        for i, item in enumerate(copies):
+            try:
+                with open(item[0], "rb", buffering=0) as f:
+                    q.put(("start", i))
+                    while True:
+                        block = f.read(block_size)
+                        if not block:
+                            break
+                        q.put(("data", block))
+                q.put(("end", None))
+            except OSError as e:
+                q.put(("error", (i, e)))
+        q.put(None)
+
+    threading.Thread(target=read, daemon=True).start()
+
+    item = None
+    f_dst = None
+    h = None
+    error = None
+    while True:
+        msg = q.get()
+        if msg is None:
+            return
+        kind, value = msg
+        if kind == "start":
+            item = copies[value]
+            h = treesum.HASH_ALGOS[algo]()
+            error = None
+            try:
+                f_dst = open(item[1] + COPY_TMP_SUFFIX, "wb")
+            except OSError as e:
+                error = e
+        elif kind == "data":
+            if error:
+                continue
+            h.update(value)
+            try:
+                f_dst.write(value)
+            except OSError as e:
+                error = e
+        else:
+            if f_dst:
+                try:
+                    if sync and kind == "end" and not error:
+                        f_dst.flush()
+                        os.fsync(f_dst.fileno())
+                    f_dst.close()
+                except OSError as e:
+                    error = error or e
+                f_dst = None
+            if kind == "error":
+                # read error, before or while reading the item
+                i, error = value
+                item = copies[i]
+            if not error:
+                try:
+                    finish_copy(item[0], item[1])
+                except OSError as e:
+                    error = e
+            if error:
+                remove_tmp(item[1])
+                yield [item, None, error]
+            else:
+                yield [item, treesum.format_hash(h, algo), None]
+            item = None
+
+
+def iter_copy_files(copies):
+    # copies [src, dst, ...] items one by one, see copy_file. yields [item, None, error or None]
+    for item in copies:
+        try:
+            copy_file(item[0], item[1])
+            yield [item, None, None]
+        except OSError as e:
+            yield [item, None, e]
+
+
+def verify_copy(dst, digest, algo):
+    # reads dst back and compares its hash. dst was flushed to disk while copying (see sync
+    # of iter_copy_pipeline) and is dropped from the page cache first (where supported),
+    # so it is really read from the target disk. raises OSError if dst can't be read
+    if hasattr(os, "posix_fadvise"):
+        with open(dst, "rb") as f:
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+    return treesum.get_file_hash(dst, algo=algo) == digest
 
 
 def main(args):
     target_dir = os.getcwd()
 
-    source_files_search_path = os.path.join(args.source_dir, args.file_pattern)
+    print(f"Indexing {target_dir}...")
+    index = index_target(target_dir)
+    cache = filedate.MetadataCache(args.cache) if args.cache else None
 
-    source_files = glob.glob(source_files_search_path, recursive=True)
+    # counters for report
+    num_copied = 0
+    num_bytes_copied = 0
+    num_present = 0
+    num_conflicts = 0
+    num_failed = 0
+    num_verify_failed = 0
+    num_no_date = 0
+    t_start = time.perf_counter()
 
-    for f in source_files:
+    # plan: [src, dst, stat result] of files to copy, and their destinations
+    copies = []
+    planned = set()
+    cache_files = cache.get_files() if cache else set()
+    for f, st in filedate.iter_glob_files(args.file_pattern, args.source_dir):
+        if os.path.normcase(f) in cache_files:
+            continue
         fp = pathlib.Path(f)
+
+        new_name, strategy = filedate.get_new_filename(fp, args.noexif, st=st, cache=cache)
+        if strategy == filedate.NewNameStrategy.SKIP_DIR:
+            continue
         print(f"{fp}")
+        if strategy == filedate.NewNameStrategy.SKIP:
+            if not filedate.re_filedate.search(fp.stem):
+                print("    -> SKIPPED")
+                continue
+            # already named YYYY-MM-DD-hhmmss_*, imported as is
+            new_name = fp.name
+        elif not new_name:
+            print("    -> NO DATE FOUND, SKIPPED")
+            num_no_date += 1
+            continue
+
+        dst_dir = os.path.join(target_dir, SUBDIR_LAYOUTS[args.subdir](new_name)) if args.subdir else target_dir
+        dst = os.path.join(dst_dir, new_name)
+        print(f"    -> {dst}")
+
+        present = find_present(index, new_name, st.st_size, f, args.hash)
+        if present:
+            print(f"    -> PRESENT: {present}")
+            num_present += 1
+            continue
+        if dst in planned:
+            # another source file with different content is copied to dst already
+            print("    -> CONFLICTS WITH ANOTHER IMPORTED FILE, SKIPPED")
+            num_conflicts += 1
+            continue
+        if os.path.exists(dst) and not args.overwrite:
+            print("    -> EXISTS WITH DIFFERENT CONTENT, SKIPPED (use --overwrite)")
+            num_conflicts += 1
+            continue
+
+        # planned copies are indexed too, by their source to hash, so duplicates are copied once.
+        # the entry of an overwritten file is replaced, as its content is gone
+        index[new_name] = [e for e in index.get(new_name, []) if e[0] != dst] + [[dst, st.st_size, None, f]]
+        copies.append([f, dst, st])
+        planned.add(dst)
+
+    if cache:
+        cache.close()
+        print(cache.get_report())
+
+    block_size = PIPELINE_BLOCK_SIZE
+    if args.iosched and copies:
+        # psutil is only needed for the I/O scheduler. copying is a single stream already,
+        # so only the read size and the order depend on the source device
+        import listpar
+        sched = listpar.IOScheduler()
+        print(sched.describe(copies[0][0]))
+        _, block_size, sort_by_inode = sched.get_limits(copies[0][2].st_dev)
+        if sort_by_inode:
+            copies.sort(key=lambda c: (c[2].st_dev, c[2].st_ino))
+
+    if not args.dry:
+        for dst_dir in {os.path.dirname(c[1]) for c in copies}:
+            os.makedirs(dst_dir, exist_ok=True)
 
-        # check if file with new_name exists under target_dir
-        # optionally compare size or hash
-        # do not copy if it exists already
-        # also, never overwrite (only if requested by user arg)
+        # hashing while copying is only needed for verifying and the list, otherwise the
+        # data is copied in the kernel
+        hashed = args.verify or args.list
+        results = iter_copy_pipeline(copies, args.algo, block_size, args.verify) if hashed else iter_copy_files(copies)
+        entries = []
+        for (src, dst, st), digest, error in results:
+            if error:
+                print(f"{src}\n    -> COPY FAILED: {error}")
+                num_failed += 1
+                continue
+            if args.verify:
+                try:
+                    verified = verify_copy(dst, digest, args.algo)
+                except OSError as e:
+                    print(f"{src}\n    -> VERIFY FAILED: {e}")
+                    num_verify_failed += 1
+                    continue
+                if not verified:
+                    print(f"{src}\n    -> VERIFY FAILED: {dst}")
+                    num_verify_failed += 1
+                    continue
+            if args.list:
+                entry = treesum.get_file_stat_entry(dst)[0]
+                entry[0] = digest
+                entries.append(entry)
+            num_copied += 1
+            num_bytes_copied += st.st_size
 
-        # add args: force_copy/force_overwrite, subdir_y/ym/ymd
+        if args.list:
+            list_path = f"{DST_LIST_FILENAME_PRE}_{datetime.datetime.now().strftime(treesum.TIME_FORMAT)}.txt"
+            with open(list_path, "w") as f_dst:
+                for t_hash, mtime_str, t_size, t in entries:
+                    f_dst.write(f"{t_hash} {mtime_str} {t_size} {t}\n")
+            print(f"List of {len(entries)} imported files written to {list_path}")
 
-        new_name = filedate.get_new_filename(fp)[0]
-        print(f"    -> {os.path.join(target_dir, new_name)}")
+    wall = time.perf_counter() - t_start
+    print(f"copied: {num_copied} ({num_bytes_copied} bytes, {num_bytes_copied / wall / 1e6:.1f} MB/s), "
+          f"present: {num_present}, conflicts: {num_conflicts}, no date: {num_no_date}, failed: {num_failed}"
+          + (f", verify failed: {num_verify_failed}" if args.verify else ""))
 
 
 if __name__ == "__main__":
     aPars = argparse.ArgumentParser(
-        description="Imports media", formatter_class=argparse.RawTextHelpFormatter)
+        description="Imports media files from source_dir to cwd, named like by filedate (YYYY-MM-DD-hhmmss_<name>).\n\
+Files already present in cwd (same name and size, anywhere below cwd) are skipped, existing files are never overwritten,\n\
+unless requested.", formatter_class=argparse.RawTextHelpFormatter)
     aPars.add_argument("source_dir", type=pathlib.Path,
                        help='source directory')
     aPars.add_argument("file_pattern", type=str,
                        help='file pattern. use \'**/*\' for all files recursive')
     aPars.add_argument('--dry', action='store_true',
                        help='perform a dry-run only')
+    aPars.add_argument('--subdir', choices=list(SUBDIR_LAYOUTS), default=None,
+                       help='import to subdirectories by year (YYYY), month (YYYY-MM) or day (YYYY-MM-DD).\n\
+default: import to cwd directly')
+    aPars.add_argument('--hash', action='store_true',
+                       help='files present in cwd need to have the same hash too, not only the same name and size')
+    aPars.add_argument('--verify', action='store_true',
+                       help='read copied files back and compare their hash to the hash computed while copying')
+    aPars.add_argument('--list', action='store_true',
+                       help=f'write a treesum compatible list of the imported files to cwd ({DST_LIST_FILENAME_PRE}_<date>.txt).\n\
+the hashes are computed while copying')
+    aPars.add_argument('--algo', choices=list(treesum.HASH_ALGOS), default=treesum.HASH_ALGO_DEFAULT,
+                       help=f'hash algorithm for --verify and --list. default: {treesum.HASH_ALGO_DEFAULT}')
+    aPars.add_argument('--iosched', action='store_true',
+                       help='read size and order by source device type (requires psutil).\n\
+files on rotating and removable media are read in inode order')
+    aPars.add_argument('--overwrite', action='store_true',
+                       help='overwrite existing files with different content')
+    aPars.add_argument('--noexif', action='store_true',
+                       help='do not use exif data at all')
+    aPars.add_argument('--cache', type=str, default=None,
+                       help='metadata cache file of filedate, keeping dates read from EXIF data across runs')
     args = aPars.parse_args()
 
     main(args)
@@ -19,12 +19,96 @@ LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 '''
+import os
+import threading
 import psutil
 
 
+# I/O limits per device class: [concurrent jobs, read size in bytes, sort by inode].
+# rotating and removable media get one sequential stream, read in inode order
+DEVICE_LIMITS = {
+    "nvme": [16, 4 * 1024 * 1024, False],
+    "ssd": [8, 4 * 1024 * 1024, False],
+    "hdd": [1, 8 * 1024 * 1024, True],
+    "removable": [1, 4 * 1024 * 1024, True],
+    "network": [4, 1024 * 1024, False],
+    "unknown": [4, 1024 * 1024, False],
+}
+
+NETWORK_FSTYPES = {"nfs", "nfs4", "cifs", "smbfs", "smb3", "sshfs", "fuse.sshfs", "afpfs", "webdav", "9p"}
+
+
+def read_sys_file(path):
+    try:
+        with open(path, "r") as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def get_device_class(partition):
+    # device class of a partition. block device details are only known on Linux (sysfs)
+    if partition.fstype.lower() in NETWORK_FSTYPES:
+        return "network"
+    name = os.path.basename(os.path.realpath(partition.device))
+    sys_path = os.path.realpath(f"/sys/class/block/{name}")
+    if not os.path.exists(sys_path):
+        return "unknown"
+    # partitions are below their disk
+    if os.path.exists(os.path.join(sys_path, "partition")):
+        sys_path = os.path.dirname(sys_path)
+    disk = os.path.basename(sys_path)
+
+    if "/usb" in sys_path or disk.startswith("mmcblk") or read_sys_file(os.path.join(sys_path, "removable")) == "1":
+        return "removable"
+    if read_sys_file(os.path.join(sys_path, "queue", "rotational")) == "1":
+        return "hdd"
+    if disk.startswith("nvme"):
+        return "nvme"
+    return "ssd"
+
+
+class IOScheduler():
+    # maps paths to their partition and device class (by st_dev of the mount points),
+    # and limits concurrent I/O per device, see DEVICE_LIMITS
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.devices = {}
+        self.semaphores = {}
+        for p in psutil.disk_partitions(all=True):
+            try:
+                st_dev = os.stat(p.mountpoint).st_dev
+            except OSError:
+                continue
+            if st_dev not in self.devices:
+                self.devices[st_dev] = [p, get_device_class(p)]
+
+    def get_device(self, st_dev):
+        # [partition or None, device class]
+        return self.devices.get(st_dev, [None, "unknown"])
+
+    def get_limits(self, st_dev):
+        # [concurrent jobs, read size in bytes, sort by inode]
+        return DEVICE_LIMITS[self.get_device(st_dev)[1]]
+
+    def get_semaphore(self, st_dev):
+        with self.lock:
+            if st_dev not in self.semaphores:
+                self.semaphores[st_dev] = threading.BoundedSemaphore(self.get_limits(st_dev)[0])
+            return self.semaphores[st_dev]
+
+    def describe(self, path):
+        st_dev = os.stat(path).st_dev
+        partition, device_class = self.get_device(st_dev)
+        jobs, read_size, sort = self.get_limits(st_dev)
+        mountpoint = partition.mountpoint if partition else "?"
+        return f"{path}: {mountpoint} ({device_class}), jobs: {jobs}, read size: {read_size // 1024} KiB" + \
+            (", inode order" if sort else "")
+
+
 def main():
     for p in psutil.disk_partitions():
-        print(f"{p.mountpoint}    ({p.opts, {p.fstype}})")
+        print(f"{p.mountpoint}    ({p.opts, {p.fstype}}) {get_device_class(p)}")
 
 
 if __name__ == "__main__":
@@ -21,11 +21,36 @@ SOFTWARE.
 '''
 import pandas as pd
 import re
-import datetime
+import os
+import sys
+import time
+import argparse
+import concurrent.futures
 
 
 INPUT_FILE = "input.ods"
 OUTPUT_FILE = "output.ods"
+OUTPUT_SHEET_NAME = "Tabelle1"
+# column types, converted in this order
+COLUMNS_DEFAULT = ["2:num", "3:num", "1:date", "4:date"]
+# rows per chunk read from CSV and Parquet files
+CHUNK_ROWS = 100000
+# prefix of output files being written, renamed to their final name when complete
+OUTPUT_TMP_PREFIX = ".tablefix-part_"
+
+# supported file types by extension. CSV and Parquet are read and written in chunks,
+# spreadsheets are loaded completely
+FILE_TYPES = {
+    ".csv": "csv",
+    ".parquet": "parquet",
+    ".pq": "parquet",
+    ".ods": "ods",
+    ".xlsx": "xlsx",
+}
+EXCEL_READ_ENGINES = {"ods": "odf", "xlsx": None}
+EXCEL_WRITE_ENGINES = {"ods": "odf", "xlsx": "xlsxwriter"}
+# output file extension by file type, for --batch
+FILE_TYPE_EXTS = {"csv": ".csv", "parquet": ".parquet", "ods": ".ods", "xlsx": ".xlsx"}
 
 RE_NUM_COMMA = re.compile(r"^(\d+)\,(\d+)$")
 RE_NUM_DOT = re.compile(r"^(\d+)\.(\d+)$")
@@ -36,85 +61,376 @@ RE_DATE_2 = re.compile(r"^\d{4}-\d{2}-\d{2}\s\d{2}:\d{2}:\d{2}$")
 RE_EMPTY = re.compile(r"^\s+$")
 
 
-def col2num(df, col_id):
-    rows = df.shape[0]
+def match_col(s, pattern):
+    # boolean mask of the str values s matching a (^...$ anchored) pattern
+    return s.str.match(pattern.pattern).fillna(False).astype(bool)
 
-    for i in range(rows):
-        if type(df.loc[i, col_id]) == float:
-            continue
 
-        re_matches = re.search(RE_NUM_COMMA, df.loc[i, col_id])
-        if re_matches != None:
-            num_str = f"{re_matches[1]}.{re_matches[2]}"
-            df.loc[i, col_id] = float(num_str)
-            continue
+def convert_unique(df, col_id, parse, what, result, stats=None):
+    # parses each distinct value of a column once and broadcasts the results to all rows,
+    # as exports repeat the same values many times. parse returns [values, valid mask] for
+    # the unique str values. the first (in row order) value not parsed raises, like the
+    # former per cell conversion. stats: col_id -> [number of values, number of values parsed]
+    col = df[col_id]
+    s = col[col.notna()].astype(str)
+    codes, uniques = pd.factorize(s)
+    values, valid = parse(pd.Series(uniques, dtype=object))
 
-        re_matches = re.search(RE_NUM_DOT, df.loc[i, col_id])
-        if re_matches != None:
-            df.loc[i, col_id] = float(df.loc[i, col_id])
-            continue
+    valid = valid.to_numpy()[codes]
+    if not valid.all():
+        raise ValueError(f"Could not parse {what} {s[~valid].iloc[0]}")
+    result[s.index] = values.to_numpy()[codes]
+    df[col_id] = result
 
-        re_matches = re.search(RE_NUM_DOT_COMMA, df.loc[i, col_id])
-        if re_matches != None:
-            num_str = f"{re_matches[1]}{re_matches[2]}.{re_matches[3]}"
-            df.loc[i, col_id] = float(num_str)
-            continue
+    if stats is not None:
+        num = stats.setdefault(col_id, [0, 0])
+        num[0] += len(s)
+        num[1] += len(uniques)
 
-        re_matches = re.search(RE_INT, df.loc[i, col_id])
-        if re_matches != None:
-            df.loc[i, col_id] = float(df.loc[i, col_id])
-            continue
 
-        raise ValueError(f"Could not parse number {df.loc[i, col_id]}")
+def parse_nums(u):
+    # vectorized: the values of each number format are normalized to "1234.5"
+    # with masks and str methods, then converted to float at once
+    m_comma = match_col(u, RE_NUM_COMMA)
+    m_dot = match_col(u, RE_NUM_DOT) | match_col(u, RE_INT)
+    m_dot_comma = match_col(u, RE_NUM_DOT_COMMA)
+    valid = m_comma | m_dot | m_dot_comma
 
+    num_str = u.where(~m_comma, u.str.replace(",", ".", regex=False))
+    num_str = num_str.where(~m_dot_comma, u.str.replace(".", "", regex=False).str.replace(",", ".", regex=False))
+    return [pd.to_numeric(num_str.where(valid)).astype(float), valid]
 
-def col2date(df, col_id):
-    rows = df.shape[0]
 
-    for i in range(rows):
-        if type(df.loc[i, col_id]) == float:
-            continue
+def parse_dates(u):
+    # vectorized: the values of each date format are converted at once, with explicit formats.
+    # whitespace only values are valid, but missing (NaT)
+    m_empty = match_col(u, RE_EMPTY)
+    m_date_1 = match_col(u, RE_DATE_1)
+    m_date_2 = match_col(u, RE_DATE_2)
 
-        re_matches = re.search(RE_EMPTY, df.loc[i, col_id])
-        if re_matches != None:
-            df.loc[i, col_id] = float("NaN")
-            continue
+    dates = pd.Series(pd.NaT, index=u.index, dtype="datetime64[ns]")
+    dates[m_date_1] = pd.to_datetime(u[m_date_1], format="%d.%m.%Y", errors="coerce")
+    dates[m_date_2] = pd.to_datetime(u[m_date_2], format="%Y-%m-%d %H:%M:%S", errors="coerce")
+    # values not matching any format, or no valid date (like 31.02.2020) are invalid
+    return [dates, m_empty | dates.notna()]
+
+
+def col2num(df, col_id, stats=None):
+    # missing cells (NaN) stay missing
+    col = df[col_id]
+    if pd.api.types.is_numeric_dtype(col):
+        df[col_id] = col.astype(float)
+        return
+    result = pd.Series(float("NaN"), index=col.index, dtype=float)
+    convert_unique(df, col_id, parse_nums, "number", result, stats)
+
+
+def col2date(df, col_id, stats=None):
+    # missing and whitespace only cells become missing (NaT)
+    col = df[col_id]
+    if pd.api.types.is_datetime64_any_dtype(col):
+        return
+    result = pd.Series(pd.NaT, index=col.index, dtype="datetime64[ns]")
+    convert_unique(df, col_id, parse_dates, "date", result, stats)
+
+
+COLUMN_CONVERTERS = {
+    "num": col2num,
+    "date": col2date,
+}
+
+
+def get_file_type(path):
+    file_type = FILE_TYPES.get(os.path.splitext(path)[1].lower())
+    if not file_type:
+        print(f"ERROR: Unsupported file type: {path}. Supported: {', '.join(FILE_TYPES)}")
+        sys.exit(1)
+    return file_type
+
+
+def parse_columns(specs):
+    # "ID:TYPE" -> [ID, converter]
+    columns = []
+    for spec in specs:
+        col_id, _, col_type = spec.partition(":")
+        if not col_id.isdigit() or col_type not in COLUMN_CONVERTERS:
+            print(f"ERROR: Invalid column spec {spec}, expected ID:TYPE with TYPE one of {list(COLUMN_CONVERTERS)}")
+            sys.exit(2)
+        columns.append([int(col_id), COLUMN_CONVERTERS[col_type]])
+    return columns
+
+
+def iter_chunks(path, chunk_rows=CHUNK_ROWS, sep=",", sheet_name=0):
+    # yields the table in path as DataFrames of str values, columns numbered from 0.
+    # values might be parsed anyway (dates, numbers) and handed over as str.
+    # then, we try to match these strings with regex and convert them to consistent type (date, float)
+    file_type = get_file_type(path)
+    if file_type == "csv":
+        # only empty fields are missing values, like in spreadsheets
+        yield from pd.read_csv(path, sep=sep, header=None, dtype=str, chunksize=chunk_rows,
+                               keep_default_na=False, na_values=[""])
+    elif file_type == "parquet":
+        # pyarrow is only needed for Parquet files
+        import pyarrow.parquet
+        for batch in pyarrow.parquet.ParquetFile(path).iter_batches(batch_size=chunk_rows):
+            # typed (number, date) columns are kept as they are by the converters
+            df = batch.to_pandas()
+            df.columns = range(df.shape[1])
+            yield df
+    else:
+        yield pd.read_excel(path, sheet_name=sheet_name, header=None, engine=EXCEL_READ_ENGINES[file_type], dtype=str)
 
-        re_matches = re.search(RE_DATE_1, df.loc[i, col_id])
-        if re_matches != None:
-            df.loc[i, col_id] = datetime.datetime.strptime(re_matches[0], "%d.%m.%Y")
-            continue
 
-        re_matches = re.search(RE_DATE_2, df.loc[i, col_id])
-        if re_matches != None:
-            df.loc[i, col_id] = datetime.datetime.strptime(re_matches[0], "%Y-%m-%d %H:%M:%S")
+def iter_sheets(path, sheet_name=None, chunk_rows=CHUNK_ROWS, sep=","):
+    # yields [sheet name, chunks] of path. sheet name is None for CSV and Parquet files.
+    # with sheet_name None, all sheets of a spreadsheet are read at once
+    file_type = get_file_type(path)
+    if file_type in ("csv", "parquet"):
+        yield [None, iter_chunks(path, chunk_rows, sep)]
+    elif sheet_name is not None:
+        yield [sheet_name, iter_chunks(path, chunk_rows, sep, sheet_name)]
+    else:
+        sheets = pd.read_excel(path, sheet_name=None, header=None, engine=EXCEL_READ_ENGINES[file_type], dtype=str)
+        for name, df in sheets.items():
+            yield [name, [df]]
+
+
+def write_chunks(path, chunks, sep=","):
+    # writes the DataFrames of chunks to path, returns the number of rows. the data is written
+    # to a temporary file next to path first, so a failed conversion leaves no partial output
+    file_type = get_file_type(path)
+    tmp_path = os.path.join(os.path.dirname(path), OUTPUT_TMP_PREFIX + os.path.basename(path))
+    try:
+        num_rows = write_chunks_file(tmp_path, file_type, chunks, sep)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    return num_rows
+
+
+def write_chunks_file(path, file_type, chunks, sep=","):
+    num_rows = 0
+    if file_type == "csv":
+        for i, df in enumerate(chunks):
+            # explicit date format, so all chunks are formatted the same
+            df.to_csv(path, sep=sep, mode="w" if i == 0 else "a", header=False, index=False,
+                      date_format="%Y-%m-%d %H:%M:%S")
+            num_rows += df.shape[0]
+    elif file_type == "parquet":
+        import pyarrow
+        import pyarrow.parquet
+        writer = None
+        try:
+            for df in chunks:
+                df = df.rename(columns=str)
+                if writer is None:
+                    table = pyarrow.Table.from_pandas(df, preserve_index=False)
+                    # text columns all empty in the first chunk have no type (null) yet
+                    schema = pyarrow.schema([pyarrow.field(f.name, pyarrow.string())
+                                             if pyarrow.types.is_null(f.type) else f for f in table.schema],
+                                            metadata=table.schema.metadata)
+                    table = table.cast(schema)
+                    writer = pyarrow.parquet.ParquetWriter(path, schema)
+                else:
+                    # all chunks are written with the schema of the first chunk
+                    table = pyarrow.Table.from_pandas(df, schema=writer.schema, preserve_index=False)
+                writer.write_table(table)
+                num_rows += df.shape[0]
+        finally:
+            if writer:
+                writer.close()
+    else:
+        # spreadsheets are written at once
+        df = pd.concat(list(chunks))
+        with pd.ExcelWriter(path, engine=EXCEL_WRITE_ENGINES[file_type]) as writer:
+            df.to_excel(writer, sheet_name=OUTPUT_SHEET_NAME, header=None, index=None)
+        num_rows = df.shape[0]
+    return num_rows
+
+
+def fix_chunks(chunks, columns, stats=None):
+    for df in chunks:
+        missing = [col_id for col_id, _ in columns if col_id not in df.columns]
+        if missing:
+            raise LookupError(f"Column {missing[0]} not in table of {df.shape[1]} columns")
+        for col_id, converter in columns:
+            converter(df, col_id, stats)
+        yield df
+
+
+def print_stats(stats):
+    # parsed values are the distinct values per chunk, all others are hits
+    for col_id, (num_values, num_parsed) in sorted(stats.items()):
+        hit_rate = f"{100 * (num_values - num_parsed) / num_values:.2f}%" if num_values else "-"
+        print(f"column {col_id}: {num_values} values, {num_parsed} parsed, {hit_rate} hit rate")
+
+
+def get_batch_tasks(paths):
+    # [input path, sheet name or None] per task. sheets of XLSX files are separate tasks.
+    # ODS files are parsed completely to read any of their sheets, so these stay one task
+    tasks = []
+    for path in paths:
+        if get_file_type(path) == "xlsx":
+            try:
+                with pd.ExcelFile(path) as f:
+                    tasks += [[path, name] for name in f.sheet_names]
+                continue
+            except Exception:
+                # reported by the task
+                pass
+        tasks.append([path, None])
+    return tasks
+
+
+def get_batch_output(path, sheet_name, out_dir, out_type=None):
+    # <out_dir>/<input name>[_<sheet name>].<ext>, ext of out_type or like the input.
+    # other characters of the sheet name are escaped as %XX (% too), so sheet names don't collide
+    ext = FILE_TYPE_EXTS[out_type or get_file_type(path)]
+    name = os.path.splitext(os.path.basename(path))[0]
+    if sheet_name is not None:
+        name += "_" + re.sub(r"[^\w\-. ]", lambda m: "".join(f"%{b:02X}" for b in m.group().encode()), str(sheet_name))
+    return os.path.join(out_dir, name + ext)
+
+
+def find_batch_conflicts(tasks, out_dir, out_type=None):
+    # [[path, path], ...] of inputs whose tasks might write the same output. outputs of tasks
+    # of all sheets (sheet name None, ODS) are only known when read, these are matched by
+    # the prefix <out_dir>/<input name>_ of their names
+    exact = {}
+    prefixes = []
+    conflicts = []
+    for path, sheet_name in tasks:
+        if sheet_name is None and get_file_type(path) in EXCEL_READ_ENGINES:
+            root, ext = os.path.splitext(get_batch_output(path, "", out_dir, out_type))
+            prefixes.append([os.path.normcase(root), ext, path])
             continue
+        out_path = os.path.normcase(get_batch_output(path, sheet_name, out_dir, out_type))
+        if out_path in exact:
+            conflicts.append([exact[out_path], path])
+        else:
+            exact[out_path] = path
+    for i, (prefix, ext, path) in enumerate(prefixes):
+        for out_path, other in exact.items():
+            if out_path.startswith(prefix) and out_path.endswith(ext):
+                conflicts.append([other, path])
+        for other_prefix, other_ext, other in prefixes[i + 1:]:
+            if ext == other_ext and (prefix.startswith(other_prefix) or other_prefix.startswith(prefix)):
+                conflicts.append([other, path])
+    return conflicts
+
+
+def run_batch_task(path, sheet_name, columns, out_dir, out_type, chunk_rows, sep):
+    # converts one file or sheet in a worker process, each sheet written to its own output.
+    # returns [[output path, rows], ...], seconds, error message or None
+    t_start = time.perf_counter()
+    outputs = []
+    try:
+        for name, chunks in iter_sheets(path, sheet_name, chunk_rows, sep):
+            out_path = get_batch_output(path, name, out_dir, out_type)
+            if os.path.abspath(out_path) == os.path.abspath(path):
+                raise ValueError("Output would overwrite input, use --outdir or --to")
+            outputs.append([out_path, write_chunks(out_path, fix_chunks(chunks, columns), sep)])
+    except Exception as e:
+        return [outputs, time.perf_counter() - t_start, f"{type(e).__name__}: {e}"]
+    return [outputs, time.perf_counter() - t_start, None]
 
-        raise ValueError(f"Could not parse date {df.loc[i, col_id]}")
 
+def main_batch(args, columns):
+    # parsing spreadsheets is CPU bound and GIL limited, so files and sheets are
+    # processed by a pool of processes
+    t_start = time.perf_counter()
+    for path in args.batch:
+        get_file_type(path)
+    tasks = get_batch_tasks(args.batch)
+    conflicts = find_batch_conflicts(tasks, args.outdir, args.to)
+    if conflicts:
+        for path, other in conflicts:
+            print(f"ERROR: {path} and {other} would write the same output in {args.outdir}")
+        sys.exit(5)
+    os.makedirs(args.outdir, exist_ok=True)
+    print(f"{len(tasks)} tasks of {len(args.batch)} files, {args.jobs} jobs")
 
-def main():
-    # Loading sheet as 'str'.
-    # Values might be parsed anyway (dates, numbers) and handed over as str.
-    # Then, we try to match these strings with regex and convert them to consistent type (date, float)
-    df = pd.read_excel(INPUT_FILE,
-                       sheet_name=0,
-                       header=None,
-                       engine="odf",
-                       dtype=str)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        futures = [executor.submit(run_batch_task, path, sheet_name, columns, args.outdir, args.to,
+                                   args.chunksize, args.sep) for path, sheet_name in tasks]
+        results = []
+        for (path, sheet_name), future in zip(tasks, futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                # e.g. a worker process terminated
+                results.append([[], 0.0, f"{type(e).__name__}: {e}"])
+
+    num_errors = 0
+    for (path, sheet_name), (outputs, seconds, error) in zip(tasks, results):
+        task_name = path if sheet_name is None else f"{path} [{sheet_name}]"
+        if error:
+            num_errors += 1
+            print(f"{seconds:8.2f} s  {task_name}\n    -> ERROR: {error}")
+            continue
+        print(f"{seconds:8.2f} s  {task_name}")
+        for out_path, num_rows in outputs:
+            print(f"    -> {out_path}: {num_rows} rows")
+
+    print(f"tasks: {len(tasks)}, errors: {num_errors}, wall: {time.perf_counter() - t_start:.2f} s, "
+          f"summed task time: {sum(r[1] for r in results):.2f} s")
+    if num_errors:
+        sys.exit(3)
 
-    col2num(df, 2)
-    col2num(df, 3)
-    col2date(df, 1)
-    col2date(df, 4)
 
-    writer = pd.ExcelWriter(OUTPUT_FILE, engine="odf")
-  
-    df.to_excel(writer, sheet_name="Tabelle1", header=None, index=None)
+def main(args):
+    columns = parse_columns(args.col or COLUMNS_DEFAULT)
+    if args.batch:
+        main_batch(args, columns)
+        return
+    if os.path.abspath(args.output) == os.path.abspath(args.input):
+        print(f"ERROR: Output would overwrite input {args.input}")
+        sys.exit(5)
+    t_start = time.perf_counter()
 
-    writer.close()
+    stats = {}
+    chunks = iter_chunks(args.input, args.chunksize, args.sep)
+    try:
+        num_rows = write_chunks(args.output, fix_chunks(chunks, columns, stats), args.sep)
+    except LookupError as e:
+        print(f"ERROR: {e}")
+        sys.exit(4)
+
+    print(f"{args.input} -> {args.output}: {num_rows} rows in {time.perf_counter() - t_start:.2f} s")
+    print_stats(stats)
 
-    pass
 
 if __name__ == "__main__":
-    main()
+    aPars = argparse.ArgumentParser(description="Converts columns of a table to consistent types (numbers, dates),\n\
+parsing values like 1,5 / 1.234,5 / 01.02.2020 / 2020-02-01 12:00:00.\n\
+Reads and writes CSV and Parquet (in chunks) and ODS/XLSX (first sheet) files.",
+                                    formatter_class=argparse.RawTextHelpFormatter)
+    aPars.add_argument("input", type=str, nargs='?', default=INPUT_FILE,
+                       help=f'input file. default: {INPUT_FILE}')
+    aPars.add_argument("output", type=str, nargs='?', default=OUTPUT_FILE,
+                       help=f'output file. default: {OUTPUT_FILE}')
+    aPars.add_argument('--col', type=str, action='append',
+                       help=f'column type as ID:TYPE, ID counting from 0, TYPE one of {list(COLUMN_CONVERTERS)}.\n\
+can be given multiple times. default: {" ".join(COLUMNS_DEFAULT)}')
+    aPars.add_argument('--chunksize', type=int, default=CHUNK_ROWS,
+                       help=f'rows per chunk for CSV and Parquet files. default: {CHUNK_ROWS}')
+    aPars.add_argument('--sep', type=str, default=",",
+                       help='field separator for CSV files. default: ,')
+    aPars.add_argument('--batch', type=str, nargs='+', default=None,
+                       help='batch mode: convert these files (all sheets), in parallel processes.\n\
+each sheet is written to <outdir>/<input name>_<sheet name>.<ext>, CSV and Parquet files to <outdir>/<input name>.<ext>.\n\
+characters of sheet names not allowed in file names are escaped as %%XX. inputs writing the same output are refused.\n\
+input and output are ignored')
+    aPars.add_argument('--outdir', type=str, default=".",
+                       help='output directory for --batch. default: cwd')
+    aPars.add_argument('--to', choices=list(FILE_TYPE_EXTS), default=None,
+                       help='output file type for --batch. default: like the input')
+    aPars.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                       help='number of processes for --batch. default: number of CPUs')
+    args = aPars.parse_args()
+
+    main(args)
@@ -28,20 +28,463 @@ import hashlib
 import sys
 import re
 import pathlib
+import collections
+import concurrent.futures
+import calendar
+import mmap
+import struct
+import heapq
+import itertools
+import tempfile
+import fnmatch
+import threading
+import queue
+import json
+import sqlite3
 
 
 TIME_FORMAT = "%Y-%m-%d-%H%M%S"
 DST_LIST_FILENAME_PRE = "treesum"
 DST_COMP_FILENAME_PRE = "treecompare"
 DST_FILENAME_EXT = "txt"
-RE_DST_LIST_FILENAME = re.compile("^treesum_\\d{4}-\\d{2}-\\d{2}-\\d{6}\.txt$")
+DST_BIN_FILENAME_EXT = "bin"
+RE_DST_LIST_FILENAME = re.compile("^treesum_\\d{4}-\\d{2}-\\d{2}-\\d{6}\.(txt|bin)$")
+# hash field: full hash, partial hash (prefixed with ~) or - (size only, quick mode).
+# hashes other than sha256 are tagged with their algorithm, like blake2b:<hash>
 RE_LIST_FILE_LINE = re.compile(
-    r"^([0-9A-F]{64})\s(\d{4}-\d{2}-\d{2}-\d{6})\s(\d+)\s(.*)$")
+    r"^(~?(?:[a-z0-9]+:)?[0-9A-F]{32,64}|-)\s(\d{4}-\d{2}-\d{2}-\d{6})\s(\d+)\s(.*)$")
+HASH_NONE = "-"
+HASH_PARTIAL_PREFIX = "~"
+HASH_ALGO_SEPARATOR = ":"
+# supported hash algorithms, all with digests of up to 32 bytes
+HASH_ALGOS = {
+    "sha256": hashlib.sha256,
+    "blake2b": lambda: hashlib.blake2b(digest_size=32),
+    "blake2s": hashlib.blake2s,
+    "sha1": hashlib.sha1,
+    "md5": hashlib.md5,
+}
+HASH_ALGO_DEFAULT = "sha256"
+# quick mode: size of the head and tail blocks used for partial hashes, in bytes
+QUICK_BLOCK_SIZE = 64 * 1024
+# binary list file: header, fixed size records sorted by (kind, digest), path table.
+# header: magic, number of records, number of fully hashed records, offset of path table, hash algorithm
+# record: digest (zero padded), mtime (unix time), size, path offset, path length, hash kind
+BIN_MAGIC = b"TREESUM2"
+BIN_HEADER = struct.Struct("<8sQQQ16s")
+BIN_RECORD = struct.Struct("<32sqQQIB3x")
+BIN_KIND_FULL = 0
+BIN_KIND_PARTIAL = 1
+BIN_KIND_NONE = 2
+# streaming compare: number of entries sorted in memory at once
+STREAM_RUN_ENTRIES = 1000000
+# default size of the read buffer used for hashing, in KiB
+HASH_CHUNK_SIZE_KIB = 1024
+# small files are handed to the worker pool in batches of up to this many bytes/files
+HASH_BATCH_BYTES = 8 * 1024 * 1024
+HASH_BATCH_FILES = 256
+# maximum number of (path, stat result) items the walker runs ahead of hashing
+WALK_AHEAD_ENTRIES = 100000
+# catalog: default database file in cwd, entries per insert batch
+CATALOG_FILENAME = "treecatalog.db"
+CATALOG_BATCH_ENTRIES = 10000
+# run stats: number of slowest files reported, minimum interval of the live progress line in seconds
+STATS_NUM_SLOWEST = 10
+STATS_PRINT_INTERVAL = 0.2
 
+# read buffers of get_file_hash, one per thread
+hash_buffers = threading.local()
 
-def get_file_hash(path):
+
+class RunStats():
+    # thread-safe counters and per-phase timers of a list run.
+    # phase times are summed over all threads
+    PHASES = ["walk", "stat", "read", "hash", "write"]
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.t_start = time.perf_counter()
+        self.t_last_print = self.t_start
+        self.phases = dict.fromkeys(RunStats.PHASES, 0.0)
+        self.files_found = 0
+        self.bytes_found = 0
+        self.walk_done = False
+        self.files_done = 0
+        self.bytes_done = 0
+        self.bytes_read = 0
+        self.files_hashed = 0
+        self.slowest = []
+
+    def add_time(self, phase, seconds):
+        with self.lock:
+            self.phases[phase] += seconds
+
+    def add_found(self, size):
+        with self.lock:
+            self.files_found += 1
+            self.bytes_found += size
+
+    def add_hashed(self, path, num_bytes, t_read, t_hash):
+        with self.lock:
+            self.phases["read"] += t_read
+            self.phases["hash"] += t_hash
+            self.bytes_read += num_bytes
+            self.files_hashed += 1
+            item = (t_read + t_hash, path, num_bytes)
+            if len(self.slowest) < STATS_NUM_SLOWEST:
+                heapq.heappush(self.slowest, item)
+            else:
+                heapq.heappushpop(self.slowest, item)
+
+    def add_done(self, size):
+        with self.lock:
+            self.files_done += 1
+            self.bytes_done += size
+
+    def get_wall(self):
+        return time.perf_counter() - self.t_start
+
+    def print_progress(self, path, force=False):
+        now = time.perf_counter()
+        if not force and now - self.t_last_print < STATS_PRINT_INTERVAL:
+            return
+        self.t_last_print = now
+        wall = self.get_wall()
+        # ETA from bytes, known once the walk is done
+        eta = "?"
+        if self.walk_done and self.bytes_done:
+            eta = f"{(self.bytes_found - self.bytes_done) * wall / self.bytes_done:.0f}s"
+        total = self.files_found if self.walk_done else f"{self.files_found}+"
+        print(f"\r{self.files_done}/{total} {self.files_done / wall:.1f} files/s "
+              f"{self.bytes_read / wall / 1e6:.1f} MB/s ETA {eta} {path}", end='', flush=True)
+
+    def to_dict(self):
+        wall = self.get_wall()
+        return {
+            "wall_s": round(wall, 3),
+            "files": self.files_done,
+            "bytes": self.bytes_done,
+            "files_hashed": self.files_hashed,
+            "bytes_read": self.bytes_read,
+            "files_per_s": round(self.files_done / wall, 1),
+            "mb_per_s": round(self.bytes_read / wall / 1e6, 1),
+            "phases_s": {k: round(v, 3) for k, v in self.phases.items()},
+            "slowest": [{"path": p, "seconds": round(t, 3), "bytes": b}
+                        for t, p, b in sorted(self.slowest, reverse=True)],
+        }
+
+    def print_report(self):
+        d = self.to_dict()
+        print(f"\nfiles: {d['files']}, bytes: {d['bytes']}, read: {d['bytes_read']}, wall: {d['wall_s']} s, "
+              f"{d['files_per_s']} files/s, {d['mb_per_s']} MB/s")
+        print("time per phase (summed over threads): " +
+              ", ".join(f"{k} {v} s" for k, v in d["phases_s"].items()))
+        if d["slowest"]:
+            print("slowest files:")
+            for f in d["slowest"]:
+                print(f"  {f['seconds']:.3f} s  {f['bytes']}  {f['path']}")
+
+
+def format_hash(h, algo):
+    # upper case hex digest, tagged with the algorithm unless it is the default
+    if algo == HASH_ALGO_DEFAULT:
+        return h.hexdigest().upper()
+    return f"{algo}{HASH_ALGO_SEPARATOR}{h.hexdigest().upper()}"
+
+
+def get_hash_algo(t_hash):
+    # algorithm of a hash field, None if there is no hash
+    if t_hash == HASH_NONE:
+        return None
+    t_hash = t_hash.lstrip(HASH_PARTIAL_PREFIX)
+    if HASH_ALGO_SEPARATOR in t_hash:
+        return t_hash.split(HASH_ALGO_SEPARATOR)[0]
+    return HASH_ALGO_DEFAULT
+
+
+def get_hash_buffer(chunk_size):
+    # one read buffer per thread, reused across files
+    buf = getattr(hash_buffers, "buf", None)
+    if buf is None or len(buf) != chunk_size:
+        buf = hash_buffers.buf = bytearray(chunk_size)
+        hash_buffers.view = memoryview(buf)
+    return buf, hash_buffers.view
+
+
+def get_file_hash(path, chunk_size=HASH_CHUNK_SIZE_KIB * 1024, algo=HASH_ALGO_DEFAULT, stats=None):
+    # read the file through one fixed buffer, reused across the files of a thread,
+    # so memory usage does not depend on the file size
+    h = HASH_ALGOS[algo]()
+    buf, view = get_hash_buffer(chunk_size)
+    t_read = 0.0
+    t_hash = 0.0
+    num_bytes = 0
+    with open(path, "rb", buffering=0) as f:
+        while True:
+            t0 = time.perf_counter()
+            n = f.readinto(buf)
+            t1 = time.perf_counter()
+            t_read += t1 - t0
+            if not n:
+                break
+            h.update(view[:n])
+            t_hash += time.perf_counter() - t1
+            num_bytes += n
+    if stats is not None:
+        stats.add_hashed(path, num_bytes, t_read, t_hash)
+    return format_hash(h, algo)
+
+
+def get_partial_file_hash(path, size, chunk_size=HASH_CHUNK_SIZE_KIB * 1024, algo=HASH_ALGO_DEFAULT, stats=None):
+    # hash of the head and tail blocks of a file.
+    # files of up to 2 blocks are hashed completely, resulting in a full hash
+    if size <= 2 * QUICK_BLOCK_SIZE:
+        return get_file_hash(path, chunk_size, algo, stats)
+    h = HASH_ALGOS[algo]()
+    t0 = time.perf_counter()
     with open(path, "rb") as f:
-        return hashlib.sha256(f.read()).hexdigest().upper()
+        head = f.read(QUICK_BLOCK_SIZE)
+        f.seek(-QUICK_BLOCK_SIZE, os.SEEK_END)
+        tail = f.read(QUICK_BLOCK_SIZE)
+    t1 = time.perf_counter()
+    h.update(head)
+    h.update(tail)
+    if stats is not None:
+        stats.add_hashed(path, len(head) + len(tail), t1 - t0, time.perf_counter() - t1)
+    return HASH_PARTIAL_PREFIX + format_hash(h, algo)
+
+
+def is_full_hash(t_hash):
+    return t_hash != HASH_NONE and not t_hash.startswith(HASH_PARTIAL_PREFIX)
+
+
+def is_partial_hash(t_hash):
+    return t_hash.startswith(HASH_PARTIAL_PREFIX)
+
+
+def get_file_stat_entry(path, st=None, previous=None):
+    # returns the list entry without hash (unless reused) and whether its hash was reused from previous.
+    # st is the stat result of path, if known already
+    if st is None:
+        st = os.stat(path)
+    # File modification time
+    mtime_struct = time.gmtime(st.st_mtime)
+    mtime_str = time.strftime(TIME_FORMAT, mtime_struct)
+    # Size
+    t_size = str(st.st_size)
+
+    # reuse hash of previous list file, if path, size and mtime are unchanged
+    if previous:
+        prev = previous.get(path)
+        if prev and prev[1] == mtime_str and prev[2] == t_size:
+            return [prev[0], mtime_str, t_size, path], True
+
+    return [HASH_NONE, mtime_str, t_size, path], False
+
+
+def get_file_entry(path, st=None, chunk_size=HASH_CHUNK_SIZE_KIB * 1024, previous=None, algo=HASH_ALGO_DEFAULT, stats=None, sched=None):
+    # returns the list entry and whether its hash was reused from previous.
+    # with an I/O scheduler (listpar.IOScheduler), files are hashed within the concurrency limit of their device
+    entry, reused = get_file_stat_entry(path, st, previous)
+
+    # Hash
+    if not (reused and is_full_hash(entry[0])):
+        if sched is None:
+            entry[0] = get_file_hash(path, chunk_size, algo, stats)
+        else:
+            with sched.get_semaphore((st or os.stat(path)).st_dev):
+                entry[0] = get_file_hash(path, chunk_size, algo, stats)
+        reused = False
+
+    return entry, reused
+
+
+def get_file_entries(tree_files, chunk_size, previous=None, algo=HASH_ALGO_DEFAULT, stats=None, sched=None):
+    return [get_file_entry(p, st, chunk_size, previous, algo, stats, sched) for p, st in tree_files]
+
+
+def batch_files(tree_files):
+    # group small files, so the pool is not flooded with tiny tasks.
+    # large files end up in a batch of their own
+    batch = []
+    batch_bytes = 0
+    for p, st in tree_files:
+        batch.append((p, st))
+        batch_bytes += st.st_size
+        if batch_bytes >= HASH_BATCH_BYTES or len(batch) >= HASH_BATCH_FILES:
+            yield batch
+            batch = []
+            batch_bytes = 0
+    if batch:
+        yield batch
+
+
+def iter_file_entries(tree_files, chunk_size, jobs=1, previous=None, algo=HASH_ALGO_DEFAULT, stats=None, sched=None):
+    # yields (entry, reused) for (path, stat result) items of tree_files,
+    # in their order, regardless of the number of jobs.
+    # tree_files may be a generator, hashing starts with its first item
+    if jobs <= 1:
+        for p, st in tree_files:
+            yield get_file_entry(p, st, chunk_size, previous, algo, stats, sched)
+        return
+
+    # hashlib releases the GIL while hashing, so threads are sufficient.
+    # the number of pending batches is bounded to limit memory usage
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        pending = collections.deque()
+        for batch in batch_files(tree_files):
+            pending.append(executor.submit(
+                get_file_entries, batch, chunk_size, previous, algo, stats, sched))
+            if len(pending) >= jobs * 4:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def get_dir_id(path):
+    # DirEntry.stat() has no inode numbers on Windows, so os.stat() is used
+    st = os.stat(path)
+    return st.st_dev, st.st_ino
+
+
+def walk_tree(path, follow_symlinks=True, excludes=(), stats=None):
+    # yields (path, stat result) of all files below path, in a single os.scandir traversal.
+    # like the glob('**') used before, hidden directories are not descended into.
+    # names or paths relative to path matching one of the excludes (fnmatch patterns) are skipped
+    # when following symlinks, the directories above are tracked to not run into loops
+    stack = [(path, frozenset([get_dir_id(path)]) if follow_symlinks else None)]
+    while stack:
+        dir_path, ancestors = stack.pop()
+        t0 = time.perf_counter()
+        try:
+            with os.scandir(dir_path) as it:
+                dir_entries = sorted(it, key=lambda e: e.name)
+        except OSError:
+            continue
+        if stats is not None:
+            stats.add_time("walk", time.perf_counter() - t0)
+
+        sub_dirs = []
+        for e in dir_entries:
+            if e.is_symlink():
+                if not follow_symlinks:
+                    continue
+            if excludes:
+                rel_path = os.path.relpath(e.path, path)
+                if any(fnmatch.fnmatch(e.name, x) or fnmatch.fnmatch(rel_path, x) for x in excludes):
+                    continue
+            try:
+                if e.is_dir():
+                    if e.name.startswith("."):
+                        continue
+                    if follow_symlinks:
+                        dir_id = get_dir_id(e.path)
+                        if dir_id in ancestors:
+                            continue
+                        sub_dirs.append((e.path, ancestors | {dir_id}))
+                    else:
+                        sub_dirs.append((e.path, None))
+                elif e.is_file():
+                    t0 = time.perf_counter()
+                    st = e.stat()
+                    if stats is not None:
+                        stats.add_time("stat", time.perf_counter() - t0)
+                    yield e.path, st
+            except OSError:
+                continue
+        stack.extend(reversed(sub_dirs))
+
+
+def iter_walk_ahead(tree_files, stats):
+    # runs the walker in a background thread, ahead of hashing by up to WALK_AHEAD_ENTRIES items,
+    # so memory usage does not depend on the size of the tree. on trees of up to that many files,
+    # the totals for the ETA are known early, otherwise once the walker has caught up
+    q = queue.Queue(maxsize=WALK_AHEAD_ENTRIES)
+
+    def walk():
+        try:
+            for p, st in tree_files:
+                stats.add_found(st.st_size)
+                q.put((p, st))
+        finally:
+            stats.walk_done = True
+            q.put(None)
+
+    threading.Thread(target=walk, daemon=True).start()
+    while True:
+        item = q.get()
+        if item is None:
+            return
+        yield item
+
+
+def map_jobs(func, items, jobs=1):
+    # like map(), but runs in a thread pool if jobs > 1. results keep the order of items
+    if jobs <= 1:
+        return map(func, items)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        return list(executor.map(func, items))
+
+
+def count_peers(sides, key):
+    # returns a function telling, for entry d on side s and a key k, how many entries
+    # with key k exist on the other sides. a single side is compared against itself
+    totals = collections.Counter()
+    per_side = collections.Counter()
+    for s, data in enumerate(sides):
+        for d in data:
+            k = key(d)
+            if k is not None:
+                totals[k] += 1
+                per_side[(s, k)] += 1
+
+    def peers(s, d, k):
+        if len(sides) == 1:
+            return totals[k] - (1 if key(d) == k else 0)
+        return totals[k] - per_side[(s, k)]
+    return peers
+
+
+def resolve_quick_entries(sides, chunk_size=HASH_CHUNK_SIZE_KIB * 1024, jobs=1, progress=True, algo=HASH_ALGO_DEFAULT, stats=None):
+    # upgrades entries in place (size only -> partial -> full hash), until all entries
+    # that might be equal to an entry on another side have a full hash.
+    # entries without full hash afterwards are known to have no equal on the other sides.
+    # returns the number of partial and full hashes computed
+    def rehash(items, hash_func):
+        i_len = len(items)
+        for i, ((s, d), t_hash) in enumerate(zip(items, map_jobs(hash_func, [d for s, d in items], jobs))):
+            if progress:
+                print(f"\r{i + 1}/{i_len} {d[3]}", end='', flush=True)
+            d[0] = t_hash
+        if progress and items:
+            print()
+
+    def partial_hash(d):
+        return get_partial_file_hash(d[3], int(d[2]), chunk_size, algo, stats)
+
+    def full_hash(d):
+        return get_file_hash(d[3], chunk_size, algo, stats)
+
+    entries = [(s, d) for s, data in enumerate(sides) for d in data]
+
+    # 1st pass: partial hash for entries sharing their size with another side
+    size_peers = count_peers(sides, lambda d: d[2])
+    todo = [(s, d) for s, d in entries
+            if d[0] == HASH_NONE and size_peers(s, d, d[2]) > 0]
+    rehash(todo, partial_hash)
+    num_partial = len(todo)
+
+    # 2nd pass: full hash for partial hashes matching another side,
+    # or sharing their size with an already fully hashed entry of another side
+    partial_peers = count_peers(sides, lambda d: (d[2], d[0]) if is_partial_hash(d[0]) else None)
+    full_size_peers = count_peers(sides, lambda d: d[2] if is_full_hash(d[0]) else None)
+    todo = [(s, d) for s, d in entries
+            if is_partial_hash(d[0]) and
+            (partial_peers(s, d, (d[2], d[0])) > 0 or full_size_peers(s, d, d[2]) > 0)]
+    rehash(todo, full_hash)
+    num_full = len(todo)
+
+    return num_partial, num_full
 
 
 def get_tree_files(path):
@@ -53,49 +496,297 @@ def get_tree_files(path):
         return []
 
 
-def parse_treesum_file(path):
+def iter_treesum_file(path):
+    # yields the entries of a list file one by one
+    if is_treesum_bin(path):
+        with open_treesum_bin(path) as mm:
+            num, num_full, paths_offset = read_bin_header(mm)
+            algo = read_bin_algo(mm)
+            for i in range(num):
+                yield get_bin_entry(mm, paths_offset, i, algo)
+        return
+
     with open(path, "r") as f:
-        lines = f.readlines()
+        for l in f:
+            matches = RE_LIST_FILE_LINE.search(l)
+            if matches:
+                yield [matches[1], matches[2], matches[3], matches[4]]
+            else:
+                print(f"ERROR: parsing file {path} failed")
+                sys.exit(3)
+
+
+def parse_treesum_file(path):
+    return list(iter_treesum_file(path))
+
+
+def sort_treesum_file(path, dst_path, tmp_dir, run_entries=STREAM_RUN_ENTRIES):
+    # external sort by hash: sorted runs of up to run_entries entries
+    # are written to tmp_dir, then merged into dst_path
+    entries = iter_treesum_file(path)
+    run_paths = []
+    while True:
+        run = list(itertools.islice(entries, run_entries))
+        if not run:
+            break
+        if not all(is_full_hash(d[0]) for d in run):
+            print(f"ERROR: Streaming compare requires fully hashed list files: {path}")
+            sys.exit(13)
+        run.sort(key=lambda d: d[0])
+        run_path = os.path.join(tmp_dir, f"run_{len(run_paths)}.{DST_FILENAME_EXT}")
+        with open(run_path, "w") as f_run:
+            for t_hash, mtime_str, t_size, t in run:
+                f_run.write(f"{t_hash} {mtime_str} {t_size} {t}\n")
+        run_paths.append(run_path)
+
+    with open(dst_path, "w") as f_dst:
+        runs = [iter_treesum_file(p) for p in run_paths]
+        for t_hash, mtime_str, t_size, t in heapq.merge(*runs, key=lambda d: d[0]):
+            f_dst.write(f"{t_hash} {mtime_str} {t_size} {t}\n")
+
+
+def iter_sorted_matches(sorted_l, sorted_r):
+    # merge-join of 2 entry streams, both sorted by hash.
+    # yields (LEFT entry, RIGHT entries with equal hash) for all LEFT entries
+    sorted_r = iter(sorted_r)
+    r = next(sorted_r, None)
+    group_hash = None
+    group = []
+    for d in sorted_l:
+        if d[0] != group_hash:
+            while r is not None and r[0] < d[0]:
+                r = next(sorted_r, None)
+            group_hash = d[0]
+            group = []
+            while r is not None and r[0] == d[0]:
+                group.append(r)
+                r = next(sorted_r, None)
+        yield d, group
+
+
+def is_treesum_bin(path):
+    with open(path, "rb") as f:
+        return f.read(len(BIN_MAGIC)) == BIN_MAGIC
+
+
+def get_bin_kind_digest(t_hash):
+    if t_hash == HASH_NONE:
+        return BIN_KIND_NONE, bytes(32)
+    kind = BIN_KIND_PARTIAL if is_partial_hash(t_hash) else BIN_KIND_FULL
+    digest = t_hash.lstrip(HASH_PARTIAL_PREFIX).split(HASH_ALGO_SEPARATOR)[-1]
+    return kind, bytes.fromhex(digest).ljust(32, b"\0")
+
+
+def get_entries_algo(entries, path):
+    # the hash algorithm used by all entries. lists mixing algorithms are refused
+    algos = {get_hash_algo(d[0]) for d in entries} - {None}
+    if len(algos) > 1:
+        print(f"ERROR: List file mixes hash algorithms {sorted(algos)}: {path}")
+        sys.exit(14)
+    return algos.pop() if algos else HASH_ALGO_DEFAULT
+
+
+def write_treesum_bin(path, data, algo=HASH_ALGO_DEFAULT):
+    records = sorted((get_bin_kind_digest(d[0]), d) for d in data)
+    num_full = sum(1 for (kind, digest), d in records if kind == BIN_KIND_FULL)
+    paths_offset = BIN_HEADER.size + len(records) * BIN_RECORD.size
+
+    with open(path, "wb") as f:
+        f.write(BIN_HEADER.pack(BIN_MAGIC, len(records), num_full, paths_offset, algo.encode()))
+        paths = []
+        offset = 0
+        for (kind, digest), d in records:
+            p = d[3].encode("utf-8", "surrogateescape")
+            mtime = calendar.timegm(time.strptime(d[1], TIME_FORMAT))
+            f.write(BIN_RECORD.pack(digest, mtime, int(d[2]), offset, len(p), kind))
+            paths.append(p)
+            offset += len(p)
+        for p in paths:
+            f.write(p)
+
+
+def read_bin_header(mm):
+    magic, num, num_full, paths_offset, algo = BIN_HEADER.unpack_from(mm, 0)
+    return num, num_full, paths_offset
 
-    data = []
-    for l in lines:
-        matches = RE_LIST_FILE_LINE.search(l)
-        if matches:
-            data.append([matches[1], matches[2], matches[3], matches[4]])
-        else:
-            print(f"ERROR: parsing file {path} failed")
-            sys.exit(3)
-    return data
+
+def read_bin_algo(mm):
+    return BIN_HEADER.unpack_from(mm, 0)[4].rstrip(b"\0").decode()
+
+
+def get_bin_digest(mm, i):
+    pos = BIN_HEADER.size + i * BIN_RECORD.size
+    return mm[pos:pos + 32]
+
+
+def get_bin_entry(mm, paths_offset, i, algo=HASH_ALGO_DEFAULT):
+    digest, mtime, size, offset, length, kind = BIN_RECORD.unpack_from(
+        mm, BIN_HEADER.size + i * BIN_RECORD.size)
+    if kind == BIN_KIND_NONE:
+        t_hash = HASH_NONE
+    else:
+        h = HASH_ALGOS[algo]()
+        t_hash = digest[:h.digest_size].hex().upper()
+        if algo != HASH_ALGO_DEFAULT:
+            t_hash = f"{algo}{HASH_ALGO_SEPARATOR}{t_hash}"
+        if kind == BIN_KIND_PARTIAL:
+            t_hash = HASH_PARTIAL_PREFIX + t_hash
+    mtime_str = time.strftime(TIME_FORMAT, time.gmtime(mtime))
+    path = mm[paths_offset + offset:paths_offset + offset + length].decode("utf-8", "surrogateescape")
+    return [t_hash, mtime_str, str(size), path]
+
+
+def open_treesum_bin(path):
+    with open(path, "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def iter_bin_matches(mm_l, mm_r):
+    # merge-join of 2 binary list files, both sorted by hash.
+    # yields (LEFT entry, RIGHT entries with equal hash) for all LEFT entries
+    num_l, num_full_l, paths_offset_l = read_bin_header(mm_l)
+    num_r, num_full_r, paths_offset_r = read_bin_header(mm_r)
+    algo = read_bin_algo(mm_l)
+    j = 0
+    for i in range(num_l):
+        d = get_bin_entry(mm_l, paths_offset_l, i, algo)
+        d_in_r = []
+        if i < num_full_l:
+            digest = get_bin_digest(mm_l, i)
+            while j < num_full_r and get_bin_digest(mm_r, j) < digest:
+                j += 1
+            k = j
+            while k < num_full_r and get_bin_digest(mm_r, k) == digest:
+                d_in_r.append(get_bin_entry(mm_r, paths_offset_r, k, algo))
+                k += 1
+        yield d, d_in_r
+
+
+def get_previous_entries(path, algo=HASH_ALGO_DEFAULT):
+    # maps file path -> entry of the latest treesum file in path.
+    # entries hashed with another algorithm are left out
+    tree_files = get_tree_files(path)
+    if len(tree_files) < 1:
+        print(f"No previous treesum file found in {path}, hashing all files")
+        return {}
+    print(f"Reusing hashes of unchanged files from {tree_files[0]}")
+    return {d[3]: d for d in parse_treesum_file(tree_files[0])
+            if get_hash_algo(d[0]) in (None, algo)}
+
+
+def list_quick(f_dst, tree_files, args, previous=None, stats=None):
+    # stat all files first, then only hash files with a size collision
+    entries = []
+    num_reused = 0
+    for p, st in tree_files:
+        entry, reused = get_file_stat_entry(p, st, previous)
+        entries.append(entry)
+        num_reused += reused
+
+    num_partial, num_full = resolve_quick_entries(
+        [entries], (args.chunksize or HASH_CHUNK_SIZE_KIB) * 1024, args.jobs, algo=args.algo, stats=stats)
+
+    t0 = time.perf_counter()
+    for t_hash, mtime_str, t_size, t in entries:
+        f_dst.write(f"{t_hash} {mtime_str} {t_size} {t}\n")
+        stats.add_done(int(t_size))
+    stats.add_time("write", time.perf_counter() - t0)
+
+    num_full_total = sum(1 for d in entries if is_full_hash(d[0]))
+    num_partial_total = sum(1 for d in entries if is_partial_hash(d[0]))
+    print(f"files: {len(entries)}, full hashes: {num_full_total}, partial hashes: {num_partial_total}, "
+          f"size only: {len(entries) - num_full_total - num_partial_total}")
+    print(f"hashes reused: {num_reused}, partial computed: {num_partial}, full computed: {num_full}")
 
 
 def main_list(args):
     now_str = datetime.datetime.now().strftime(TIME_FORMAT)
 
+    previous = None
+    if args.incremental:
+        previous = get_previous_entries(os.getcwd(), args.algo)
+
+    chunk_size = (args.chunksize or HASH_CHUNK_SIZE_KIB) * 1024
+    sched = None
+    sort_by_inode = False
+    if args.iosched:
+        # psutil is only needed for the I/O scheduler
+        import listpar
+        sched = listpar.IOScheduler()
+        print(sched.describe(os.getcwd()))
+        _, device_chunk_size, sort_by_inode = sched.get_limits(os.stat(os.getcwd()).st_dev)
+        # -j stays the number of threads, the semaphores of sched limit the concurrent reads per device.
+        # the read size of the device is used, unless -chunksize is given
+        if args.chunksize is None:
+            chunk_size = device_chunk_size
+
+    stats = RunStats()
     with open(f"{DST_LIST_FILENAME_PRE}_{now_str}.{DST_FILENAME_EXT}", "w") as f_dst:
-        tree_files = glob.glob(os.path.join(
-            os.getcwd(), "**/*"), recursive=True)
-        tree_files.extend(glob.glob(os.path.join(
-            os.getcwd(), "**/.*"), recursive=True))
-        tree_files = [t for t in tree_files if os.path.isfile(t)]
-        tree_files = [t for t in tree_files if not RE_DST_LIST_FILENAME.match(
-            pathlib.Path(t).name)]
-
-        t_ctr = 1
-        t_len = len(tree_files)
-        for t in tree_files:
-            print(f"\r{t_ctr}/{t_len} {t}", end='', flush=True)
-
-            # Hash
-            t_hash = get_file_hash(t)
-            # File modification time
-            t_mtime = os.path.getmtime(t)
-            mtime_struct = time.gmtime(t_mtime)
-            mtime_str = time.strftime(TIME_FORMAT, mtime_struct)
-            # Size
-            t_size = os.path.getsize(t)
+        # files are streamed from the walker to the hashing stage
+        tree_files = walk_tree(os.getcwd(), not args.nosymlinks, args.exclude, stats)
+        tree_files = ((t, st) for t, st in tree_files if not RE_DST_LIST_FILENAME.match(
+            pathlib.Path(t).name))
+        if sort_by_inode:
+            # on rotating media, inode order is closer to the on-disk order than path order.
+            # this needs the whole tree before hashing starts, and the list is written in that order
+            tree_files = sorted(tree_files, key=lambda x: (x[1].st_dev, x[1].st_ino))
 
-            f_dst.write(f"{t_hash} {mtime_str} {t_size} {t}\n")
-            t_ctr += 1
+        if args.quick:
+            list_quick(f_dst, tree_files, args, previous, stats)
+        else:
+            t_ctr = 0
+            num_reused = 0
+            t = ""
+            for (t_hash, mtime_str, t_size, t), reused in iter_file_entries(
+                    iter_walk_ahead(tree_files, stats), chunk_size, args.jobs, previous, args.algo, stats, sched):
+                t_ctr += 1
+                stats.add_done(int(t_size))
+                stats.print_progress(t)
+
+                t0 = time.perf_counter()
+                f_dst.write(f"{t_hash} {mtime_str} {t_size} {t}\n")
+                stats.add_time("write", time.perf_counter() - t0)
+                num_reused += reused
+            stats.print_progress(t, force=True)
+
+            if args.incremental:
+                print(f"\nhashes reused: {num_reused}, recomputed: {t_ctr - num_reused}")
+
+    stats.print_report()
+    if args.stats_json:
+        with open(args.stats_json, "w") as f:
+            json.dump(stats.to_dict(), f, indent=2)
+
+
+def print_comparison(iter_matches):
+    # iter_matches() yields (LEFT entry, RIGHT entries with equal hash) for all LEFT entries.
+    # it is called once per section, so the matches are never held in memory at once
+    num_not_found = sum(1 for d, d_in_r in iter_matches() if len(d_in_r) == 0)
+
+    print("*******************************************************")
+    print(
+        f"These {num_not_found} files exist in LEFT, but were not found in RIGHT:")
+    for d, d_in_r in iter_matches():
+        if len(d_in_r) == 0:
+            print(f"  {d[3]} {d[1]} {d[2]} {d[0]}")
+    print("*******************************************************")
+
+    print("ALL files from LEFT:")
+    for d, d_in_r in iter_matches():
+        print(f"{d[0]}\n  {d[1]} (modified)\n  {d[2]} (size)\n  (LEFT)  {d[3]}")
+        for dr in d_in_r:
+            print(f"  (RIGHT) {dr[3]}")
+        if len(d_in_r) == 0:
+            print("  (RIGHT) NOT FOUND")
+
+
+def check_compare_algos(algo_l, algo_r):
+    # hashes of different algorithms never match, so such lists are not compared
+    if algo_l != algo_r:
+        print(f"ERROR: LEFT ({algo_l}) and RIGHT ({algo_r}) use different hash algorithms. "
+              f"Create both list files with the same -algo.")
+        sys.exit(15)
+    return algo_l
 
 
 def main_compare(args):
@@ -168,28 +859,260 @@ def main_compare(args):
     print(f"  LEFT:  {file_l}")
     print(f"  RIGHT: {file_r}")
 
+    # fully hashed binary list files are merge-joined without loading them
+    if is_treesum_bin(file_l) and is_treesum_bin(file_r):
+        with open_treesum_bin(file_l) as mm_l, open_treesum_bin(file_r) as mm_r:
+            num_l, num_full_l, _ = read_bin_header(mm_l)
+            num_r, num_full_r, _ = read_bin_header(mm_r)
+            check_compare_algos(read_bin_algo(mm_l), read_bin_algo(mm_r))
+            if num_l == num_full_l and num_r == num_full_r:
+                print_comparison(lambda: iter_bin_matches(mm_l, mm_r))
+                return
+
+    # otherwise, both list files are sorted by hash on disk and merge-joined
+    if args.stream:
+        check_compare_algos(get_entries_algo(iter_treesum_file(file_l), file_l),
+                            get_entries_algo(iter_treesum_file(file_r), file_r))
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            sorted_l = os.path.join(tmp_dir, f"left.{DST_FILENAME_EXT}")
+            sorted_r = os.path.join(tmp_dir, f"right.{DST_FILENAME_EXT}")
+            sort_treesum_file(file_l, sorted_l, tmp_dir)
+            sort_treesum_file(file_r, sorted_r, tmp_dir)
+            print_comparison(lambda: iter_sorted_matches(
+                iter_treesum_file(sorted_l), iter_treesum_file(sorted_r)))
+        return
+
     # Load the actual data from files
     data_l = parse_treesum_file(file_l)
     data_r = parse_treesum_file(file_r)
+    algo = check_compare_algos(get_entries_algo(data_l, file_l),
+                               get_entries_algo(data_r, file_r))
 
-    hash_r = [d[0] for d in data_r]
-    data_l_not_found_in_r = [l for l in data_l if l[0] not in hash_r]
+    # entries of quick list files are hashed where required to tell them apart,
+    # which needs the listed files to be accessible
+    if not all(is_full_hash(d[0]) for d in data_l + data_r):
+        print("Hashing files without full hash, which share their size with the other side...")
+        try:
+            resolve_quick_entries([data_l, data_r], jobs=args.jobs, algo=algo)
+        except OSError as e:
+            print(f"ERROR: Could not hash listed file: {e}")
+            sys.exit(10)
+
+    # index RIGHT entries by hash: hash -> [entries].
+    # entries without full hash have no equal on the other side
+    index_r = collections.defaultdict(list)
+    for r in data_r:
+        if is_full_hash(r[0]):
+            index_r[r[0]].append(r)
+
+    print_comparison(lambda: ((d, index_r.get(d[0], [])) for d in data_l))
+
+
+def main_dupes(args):
+    path = args.left or os.getcwd()
+    file_l = None
+    if os.path.isdir(path):
+        tree_files = get_tree_files(path)
+        if tree_files:
+            file_l = tree_files[0]
+    else:
+        file_l = path
+
+    # only files sharing their size with another file are kept (empty files are ignored).
+    # a list file is read twice for that, so only the candidates are held in memory
+    if file_l:
+        file_l = os.path.abspath(file_l)
+        print(f"Finding duplicates in {file_l}...")
+        sizes = collections.Counter(d[2] for d in iter_treesum_file(file_l))
+        candidates = [d for d in iter_treesum_file(file_l) if d[2] != "0" and sizes[d[2]] > 1]
+        algo = get_entries_algo(candidates, file_l)
+    else:
+        print(f"No treesum file found in {path}, finding duplicates by hashing files...")
+        tree_files = walk_tree(os.path.abspath(path), not args.nosymlinks, args.exclude)
+        entries = [get_file_stat_entry(t, st)[0] for t, st in tree_files
+                   if not RE_DST_LIST_FILENAME.match(pathlib.Path(t).name)]
+        sizes = collections.Counter(d[2] for d in entries)
+        candidates = [d for d in entries if d[2] != "0" and sizes[d[2]] > 1]
+        algo = args.algo
+
+    # size -> partial hash -> full hash, for entries not fully hashed yet
+    try:
+        resolve_quick_entries([candidates], (args.chunksize or HASH_CHUNK_SIZE_KIB) * 1024, args.jobs, algo=algo)
+    except OSError as e:
+        print(f"ERROR: Could not hash listed file: {e}")
+        sys.exit(10)
+
+    groups = collections.defaultdict(list)
+    for d in candidates:
+        if is_full_hash(d[0]):
+            groups[d[0]].append(d)
+    groups = [g for g in groups.values() if len(g) > 1]
+    # most wasted bytes first
+    groups.sort(key=lambda g: int(g[0][2]) * (len(g) - 1), reverse=True)
+
+    num_wasted = 0
+    for g in groups:
+        wasted = int(g[0][2]) * (len(g) - 1)
+        num_wasted += wasted
+        print(f"{g[0][0]}\n  {g[0][2]} (size) x{len(g)}, {wasted} bytes wasted")
+        for d in g:
+            print(f"  {d[3]}")
 
     print("*******************************************************")
-    print(
-        f"These {len(data_l_not_found_in_r)} files exist in LEFT, but were not found in RIGHT:")
-    for d in data_l_not_found_in_r:
-        print(f"  {d[3]} {d[1]} {d[2]} {d[0]}")
-    print("*******************************************************")
+    print(f"duplicate groups: {len(groups)}, duplicate files: {sum(len(g) - 1 for g in groups)}, "
+          f"reclaimable: {num_wasted} bytes")
 
-    print("ALL files from LEFT:")
-    for d in data_l:
-        print(f"{d[0]}\n  {d[1]} (modified)\n  {d[2]} (size)\n  (LEFT)  {d[3]}")
-        d_in_r = [r for r in data_r if d[0] == r[0]]
-        for dr in d_in_r:
-            print(f"  (RIGHT) {dr[3]}")
-        if len(d_in_r) == 0:
-            print("  (RIGHT) NOT FOUND")
+
+def open_catalog(path):
+    db = sqlite3.connect(path)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    db.executescript("""
+        CREATE TABLE IF NOT EXISTS snapshots(
+            id INTEGER PRIMARY KEY, path TEXT UNIQUE NOT NULL, algo TEXT NOT NULL,
+            added TEXT NOT NULL, num_files INTEGER NOT NULL);
+        CREATE TABLE IF NOT EXISTS files(
+            snapshot INTEGER NOT NULL REFERENCES snapshots(id),
+            hash TEXT NOT NULL, mtime TEXT NOT NULL, size INTEGER NOT NULL, path TEXT NOT NULL);
+        CREATE INDEX IF NOT EXISTS files_hash ON files(hash, snapshot);
+        CREATE INDEX IF NOT EXISTS files_size ON files(size);
+        CREATE INDEX IF NOT EXISTS files_snapshot_path ON files(snapshot, path);
+    """)
+    return db
+
+
+def add_catalog_snapshot(db, path):
+    # ingests a list file in one transaction. a list file added again replaces its snapshot
+    algos = set()
+
+    def rows(snapshot_id):
+        for t_hash, mtime_str, t_size, t in iter_treesum_file(path):
+            algos.add(get_hash_algo(t_hash))
+            yield snapshot_id, t_hash, mtime_str, int(t_size), t
+
+    with db:
+        row = db.execute("SELECT id FROM snapshots WHERE path = ?", (path,)).fetchone()
+        if row:
+            db.execute("DELETE FROM files WHERE snapshot = ?", row)
+            db.execute("DELETE FROM snapshots WHERE id = ?", row)
+        snapshot_id = db.execute("INSERT INTO snapshots(path, algo, added, num_files) VALUES (?, '', ?, 0)",
+                                 (path, datetime.datetime.now().strftime(TIME_FORMAT))).lastrowid
+        it = rows(snapshot_id)
+        num = 0
+        while True:
+            batch = list(itertools.islice(it, CATALOG_BATCH_ENTRIES))
+            if not batch:
+                break
+            db.executemany("INSERT INTO files VALUES (?, ?, ?, ?, ?)", batch)
+            num += len(batch)
+        algos.discard(None)
+        if len(algos) > 1:
+            print(f"ERROR: List file mixes hash algorithms {sorted(algos)}: {path}")
+            sys.exit(14)
+        algo = algos.pop() if algos else HASH_ALGO_DEFAULT
+        db.execute("UPDATE snapshots SET algo = ?, num_files = ? WHERE id = ?", (algo, num, snapshot_id))
+    return snapshot_id, num
+
+
+def get_catalog_snapshot(db, name):
+    # snapshot by id, or by list file path (latest list file, if name is a directory)
+    if name.isdigit():
+        row = db.execute("SELECT id, path, algo FROM snapshots WHERE id = ?", (int(name),)).fetchone()
+    else:
+        if os.path.isdir(name):
+            tree_files = get_tree_files(name)
+            name = tree_files[0] if tree_files else name
+        row = db.execute("SELECT id, path, algo FROM snapshots WHERE path = ?",
+                         (os.path.abspath(name),)).fetchone()
+    if not row:
+        print(f"ERROR: Snapshot not in catalog: {name}")
+        sys.exit(17)
+    return row
+
+
+def main_catalog(args):
+    db = open_catalog(args.db)
+
+    for name in args.add:
+        if os.path.isdir(name):
+            tree_files = get_tree_files(name)
+            if not tree_files:
+                print(f"ERROR: No treesum file found in {name}")
+                sys.exit(16)
+            name = tree_files[0]
+        t_start = time.perf_counter()
+        snapshot_id, num = add_catalog_snapshot(db, os.path.abspath(name))
+        print(f"Added snapshot {snapshot_id}: {os.path.abspath(name)}, {num} files in {time.perf_counter() - t_start:.2f} s")
+
+    if args.hash:
+        # hashes are stored as in the list files: upper case, tagged with the algorithm unless default
+        algo, _, digest = args.hash.rpartition(HASH_ALGO_SEPARATOR)
+        algo = algo.lower()
+        t_hash = digest.upper() if algo in ("", HASH_ALGO_DEFAULT) else f"{algo}{HASH_ALGO_SEPARATOR}{digest.upper()}"
+        rows = db.execute("""SELECT s.id, s.path, f.size, f.path FROM files f JOIN snapshots s ON s.id = f.snapshot
+                             WHERE f.hash = ? ORDER BY s.id, f.path""", (t_hash,)).fetchall()
+        for snapshot_id, snapshot_path, size, path in rows:
+            print(f"{snapshot_id} {snapshot_path}\n  {size} (size) {path}")
+        print("*******************************************************")
+        print(f"{t_hash} found {len(rows)} times in {len({r[0] for r in rows})} snapshots")
+
+    elif args.left:
+        # files of LEFT snapshot whose hash is in none of the -notin snapshots (all other snapshots, if not given)
+        left = get_catalog_snapshot(db, args.left)
+        if args.notin:
+            others = [get_catalog_snapshot(db, n) for n in args.notin]
+        else:
+            others = db.execute("SELECT id, path, algo FROM snapshots WHERE id != ?", (left[0],)).fetchall()
+        for o in others:
+            check_compare_algos(left[2], o[2])
+        other_ids = [o[0] for o in others]
+        print(f"Files in {left[1]}\nnot present in {len(other_ids)} other snapshots:")
+        for o in others:
+            print(f"  {o[0]} {o[1]}")
+        print("*******************************************************")
+        # only full hashes can be matched
+        rows = db.execute(f"""SELECT a.size, a.path FROM files a WHERE a.snapshot = ?
+                              AND (a.hash = ? OR a.hash LIKE ? OR NOT EXISTS (
+                                  SELECT 1 FROM files b WHERE b.hash = a.hash
+                                  AND b.snapshot IN ({",".join("?" * len(other_ids))})))
+                              ORDER BY a.path""",
+                          [left[0], HASH_NONE, f"{HASH_PARTIAL_PREFIX}%"] + other_ids).fetchall()
+        for size, path in rows:
+            print(f"{size} (size) {path}")
+        print("*******************************************************")
+        print(f"not present: {len(rows)} files, {sum(r[0] for r in rows)} bytes")
+
+    elif not args.add:
+        for snapshot_id, path, algo, added, num in db.execute(
+                "SELECT id, path, algo, added, num_files FROM snapshots ORDER BY id"):
+            print(f"{snapshot_id} {added} {algo} {num} files {path}")
+
+    db.close()
+
+
+def main_convert(args):
+    if not args.left or not os.path.isfile(args.left):
+        print(f"ERROR: No list file given to convert: {args.left}")
+        sys.exit(11)
+
+    to_bin = not is_treesum_bin(args.left)
+    if args.right:
+        file_dst = args.right
+    else:
+        ext = DST_BIN_FILENAME_EXT if to_bin else DST_FILENAME_EXT
+        file_dst = f"{os.path.splitext(args.left)[0]}.{ext}"
+    if os.path.exists(file_dst):
+        print(f"ERROR: Destination file exists already: {file_dst}")
+        sys.exit(12)
+
+    data = parse_treesum_file(args.left)
+    if to_bin:
+        write_treesum_bin(file_dst, data, get_entries_algo(data, args.left))
+    else:
+        with open(file_dst, "w") as f_dst:
+            for t_hash, mtime_str, t_size, t in data:
+                f_dst.write(f"{t_hash} {mtime_str} {t_size} {t}\n")
+    print(f"Converted {len(data)} entries: {args.left} -> {file_dst}")
 
 
 if __name__ == "__main__":
@@ -197,20 +1120,65 @@ if __name__ == "__main__":
 Answers the question: which files in LEFT directory are (based on hash) also present in RIGHT directory,\n\
 even if moved or renamed?\n\
   list: Creates a treesum list file containing all hashes of all files in cwd, recursively\n\
-  compare: use -left and -right args to compare 2 list files",
+  compare: use -left and -right args to compare 2 list files\n\
+  convert: converts list file -left between text and binary format (to -right, or next to -left)\n\
+  dupes: lists duplicate files in list file -left (or latest list file in -left directory, defaults to cwd).\n\
+         If there is no list file, the files in -left directory are hashed\n\
+  catalog: adds list files to a SQLite catalog (-add) and queries it for files of snapshot -left\n\
+           not present in the -notin snapshots (all others, if not given), or for snapshots containing -hash.\n\
+           Lists the snapshots, if there is no query. Snapshots are given by id, list file or directory",
                                     formatter_class=argparse.RawTextHelpFormatter)
     aPars.add_argument("command", type=str,
-                       help="Command to execute: [list, compare]")
+                       help="Command to execute: [list, compare, convert, dupes, catalog]")
     aPars.add_argument("-left", type=str,
-                       help="Left side for comparison [compare]. If directory, latest list file is used. Defaults to cwd.")
+                       help="Left side for comparison [compare, dupes, catalog]. If directory, latest list file is used. Defaults to cwd.")
     aPars.add_argument("-right", type=str,
                        help="Right side for comparison [compare]. If directory, latest list file is used.")
+    aPars.add_argument("-chunksize", type=int, default=None,
+                       help=f"Read buffer size for hashing in KiB [list, dupes]. Defaults to {HASH_CHUNK_SIZE_KIB}.")
+    aPars.add_argument("-j", "-jobs", dest="jobs", type=int, default=1,
+                       help="Number of files hashed in parallel [list, compare, dupes]. Defaults to 1.")
+    aPars.add_argument("-incremental", action="store_true",
+                       help="Reuse hashes from latest list file in cwd for files with unchanged path, size and mtime [list].")
+    aPars.add_argument("-quick", action="store_true",
+                       help="Only hash files sharing their size with another file, partially first [list].\n\
+Compare hashes such files on demand, if the list files are not fully hashed.")
+    aPars.add_argument("-stream", action="store_true",
+                       help="Sort list files by hash on disk and merge-join them, for lists larger than RAM [compare].\n\
+Requires fully hashed list files. LEFT files are reported in hash order.")
+    aPars.add_argument("-algo", choices=list(HASH_ALGOS), default=HASH_ALGO_DEFAULT,
+                       help=f"Hash algorithm [list, dupes]. Defaults to {HASH_ALGO_DEFAULT}. It is recorded per line,\n\
+blake2b is usually faster than sha256, md5 is fastest but not collision resistant.")
+    aPars.add_argument("-stats-json", dest="stats_json", type=str,
+                       help="Write run stats (throughput, time per phase, slowest files) to this JSON file [list].")
+    aPars.add_argument("-db", type=str, default=CATALOG_FILENAME,
+                       help=f"Catalog database file [catalog]. Defaults to {CATALOG_FILENAME}.")
+    aPars.add_argument("-add", action="append", default=[],
+                       help="List file (or directory with list file) to add to the catalog [catalog]. Can be given multiple times.")
+    aPars.add_argument("-notin", action="append", default=[],
+                       help="Snapshot to check -left against [catalog]. Can be given multiple times.")
+    aPars.add_argument("-hash", type=str,
+                       help="Hash to find in all snapshots [catalog].")
+    aPars.add_argument("-iosched", action="store_true",
+                       help="Limit concurrent reads per device (up to -j), and use a read size by device type\n\
+unless -chunksize is given (requires psutil) [list]. Rotating and removable media are read by one job, in inode order.")
+    aPars.add_argument("-exclude", action="append", default=[],
+                       help="Skip files and directories whose name or relative path matches this pattern [list, dupes].\n\
+Can be given multiple times, e.g. -exclude '*.tmp' -exclude 'cache/*'")
+    aPars.add_argument("-nosymlinks", action="store_true",
+                       help="Do not follow symlinks to files and directories [list, dupes].")
     args = aPars.parse_args()
 
     if args.command == "list":
         main_list(args)
     elif args.command == "compare":
         main_compare(args)
+    elif args.command == "convert":
+        main_convert(args)
+    elif args.command == "dupes":
+        main_dupes(args)
+    elif args.command == "catalog":
+        main_catalog(args)
     else:
         print(f"ERROR: Unknown command {args.command}")
         sys.exit(1)
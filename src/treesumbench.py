@@ -0,0 +1,235 @@
+'''
+Copyright (c) 2025 Alexander Scholz
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+import os
+import sys
+import time
+import json
+import math
+import random
+import shlex
+import shutil
+import datetime
+import platform
+import argparse
+import tempfile
+import subprocess
+
+
+TIME_FORMAT = "%Y-%m-%d-%H%M%S"
+DST_FILENAME_PRE = "treesumbench"
+TREESUM_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "treesum.py")
+# files per generated directory
+FILES_PER_DIR = 100
+
+
+def get_file_size(rng, args):
+    if args.dist == "uniform":
+        return rng.randint(args.min_size, args.max_size)
+    # lognormal, centered between min and max on a log scale
+    mu = (math.log(max(args.min_size, 1)) + math.log(args.max_size)) / 2
+    size = int(rng.lognormvariate(mu, args.sigma))
+    return min(max(size, args.min_size), args.max_size)
+
+
+def generate_tree(path, args):
+    # LEFT: args.files files, args.dupes of them copies of earlier files.
+    # RIGHT: args.overlap of the LEFT files under other names (hard links, if possible)
+    rng = random.Random(args.seed)
+    path_l = os.path.join(path, "left")
+    path_r = os.path.join(path, "right")
+    os.makedirs(path_l)
+    os.makedirs(path_r)
+
+    files_l = []
+    num_bytes = 0
+    for i in range(args.files):
+        dir_path = os.path.join(path_l, f"d{i // FILES_PER_DIR:05d}")
+        os.makedirs(dir_path, exist_ok=True)
+        file_path = os.path.join(dir_path, f"f{i:07d}.bin")
+        if files_l and rng.random() < args.dupes:
+            shutil.copyfile(rng.choice(files_l), file_path)
+        else:
+            with open(file_path, "wb") as f:
+                f.write(rng.randbytes(get_file_size(rng, args)))
+        files_l.append(file_path)
+        num_bytes += os.path.getsize(file_path)
+
+    num_r = 0
+    for i, file_path in enumerate(files_l):
+        if rng.random() >= args.overlap:
+            continue
+        dir_path = os.path.join(path_r, f"r{i // FILES_PER_DIR:05d}")
+        os.makedirs(dir_path, exist_ok=True)
+        dst_path = os.path.join(dir_path, f"moved_{i:07d}.bin")
+        try:
+            os.link(file_path, dst_path)
+        except OSError:
+            shutil.copyfile(file_path, dst_path)
+        num_r += 1
+
+    return path_l, path_r, num_bytes, num_r
+
+
+def run_phase(name, cmd, cwd, files, num_bytes):
+    # runs treesum in a child process, to measure its own peak RSS
+    print(f"{name}: {' '.join(cmd[2:])}")
+    t_start = time.perf_counter()
+    proc = subprocess.Popen(cmd, cwd=cwd, stdout=subprocess.DEVNULL)
+    peak_rss_kib = None
+    if hasattr(os, "wait4"):
+        _, status, rusage = os.wait4(proc.pid, 0)
+        returncode = os.waitstatus_to_exitcode(status)
+        # ru_maxrss is in bytes on macOS, in KiB elsewhere
+        peak_rss_kib = rusage.ru_maxrss // 1024 if sys.platform == "darwin" else rusage.ru_maxrss
+    else:
+        returncode = proc.wait()
+    wall = time.perf_counter() - t_start
+
+    if returncode != 0:
+        print(f"ERROR: {name} failed with exit code {returncode}")
+        sys.exit(2)
+
+    return {
+        "wall_s": round(wall, 3),
+        "files": files,
+        "bytes": num_bytes,
+        "files_per_s": round(files / wall, 1),
+        "mb_per_s": round(num_bytes / wall / 1e6, 1),
+        "peak_rss_kib": peak_rss_kib,
+    }
+
+
+def get_git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(TREESUM_SCRIPT),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results, baseline=None):
+    print(f"{'phase':<12}{'wall [s]':>10}{'files/s':>12}{'MB/s':>10}{'peak RSS [MiB]':>16}")
+    for name, r in results["phases"].items():
+        rss = f"{r['peak_rss_kib'] / 1024:.1f}" if r["peak_rss_kib"] else "-"
+        line = f"{name:<12}{r['wall_s']:>10.3f}{r['files_per_s']:>12.1f}{r['mb_per_s']:>10.1f}{rss:>16}"
+        if baseline and name in baseline["phases"]:
+            line += f"   x{baseline['phases'][name]['wall_s'] / r['wall_s']:.2f} vs baseline"
+        print(line)
+
+
+def main(args):
+    python = sys.executable
+    list_args = shlex.split(args.list_args)
+    compare_args = shlex.split(args.compare_args)
+
+    tmp_dir = tempfile.mkdtemp(prefix="treesumbench_", dir=args.tmp)
+    try:
+        print(f"Generating {args.files} files in {tmp_dir}...")
+        path_l, path_r, num_bytes, num_r = generate_tree(tmp_dir, args)
+        num_bytes_r = sum(os.path.getsize(os.path.join(d, f))
+                          for d, _, fs in os.walk(path_r) for f in fs)
+
+        # page cache is warm after generating, so these are no cold-cache numbers
+        phases = {}
+        phases["list_left"] = run_phase(
+            "list_left", [python, TREESUM_SCRIPT, "list"] + list_args, path_l, args.files, num_bytes)
+        phases["list_right"] = run_phase(
+            "list_right", [python, TREESUM_SCRIPT, "list"] + list_args, path_r, num_r, num_bytes_r)
+        phases["compare"] = run_phase(
+            "compare", [python, TREESUM_SCRIPT, "compare", "-left", path_l, "-right", path_r] + compare_args,
+            tmp_dir, args.files + num_r, num_bytes + num_bytes_r)
+    finally:
+        if not args.keep:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    results = {
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "revision": get_git_revision(),
+        "machine": {
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "cpus": os.cpu_count(),
+            "python": platform.python_version(),
+        },
+        "params": {
+            "files": args.files,
+            "dist": args.dist,
+            "min_size": args.min_size,
+            "max_size": args.max_size,
+            "sigma": args.sigma,
+            "dupes": args.dupes,
+            "overlap": args.overlap,
+            "seed": args.seed,
+            "list_args": args.list_args,
+            "compare_args": args.compare_args,
+        },
+        "phases": phases,
+    }
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+
+    print_results(results, baseline)
+
+    json_path = args.json or f"{DST_FILENAME_PRE}_{datetime.datetime.now().strftime(TIME_FORMAT)}.json"
+    with open(json_path, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {json_path}")
+
+
+if __name__ == "__main__":
+    aPars = argparse.ArgumentParser(description="Benchmark for treesum list and compare on a generated, synthetic tree.\n\
+Reports wall time, files/s, MB/s and peak RSS per phase, and saves the results as JSON.",
+                                    formatter_class=argparse.RawTextHelpFormatter)
+    aPars.add_argument('--files', type=int, default=1000,
+                       help='number of files in LEFT tree. default: 1000')
+    aPars.add_argument('--dist', choices=["lognormal", "uniform"], default="lognormal",
+                       help='file size distribution. default: lognormal')
+    aPars.add_argument('--min-size', type=int, default=0,
+                       help='minimum file size in bytes. default: 0')
+    aPars.add_argument('--max-size', type=int, default=16 * 1024 * 1024,
+                       help='maximum file size in bytes. default: 16 MiB')
+    aPars.add_argument('--sigma', type=float, default=2.0,
+                       help='sigma of lognormal distribution. default: 2.0')
+    aPars.add_argument('--dupes', type=float, default=0.1,
+                       help='ratio of LEFT files that are copies of other LEFT files. default: 0.1')
+    aPars.add_argument('--overlap', type=float, default=0.5,
+                       help='ratio of LEFT files also present (renamed) in RIGHT tree. default: 0.5')
+    aPars.add_argument('--seed', type=int, default=0,
+                       help='seed for generating the tree. default: 0')
+    aPars.add_argument('--list-args', type=str, default="",
+                       help='extra arguments for treesum list, given with =, e.g. --list-args="-j 4 -algo blake2b"')
+    aPars.add_argument('--compare-args', type=str, default="",
+                       help='extra arguments for treesum compare, given with =, e.g. --compare-args=-stream')
+    aPars.add_argument('--tmp', type=str, default=None,
+                       help='directory to generate the tree in. default: system temp directory')
+    aPars.add_argument('--keep', action='store_true',
+                       help='do not delete the generated tree')
+    aPars.add_argument('--json', type=str, default=None,
+                       help='output JSON file. default: treesumbench_<date>.json in cwd')
+    aPars.add_argument('--baseline', type=str, default=None,
+                       help='JSON file of a previous run to compare wall times against')
+    args = aPars.parse_args()
+
+    main(args)